@@ -0,0 +1,178 @@
+"""Заглушки MinIO и RabbitMQ в памяти процесса для бенчмарков"""
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from src.message_broker.broker_service import RabbitMQService
+
+
+def _client_error(code: str, status: int, operation: str, headers: Optional[Dict[str, str]] = None) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code},
+                        "ResponseMetadata": {"HTTPStatusCode": status, "HTTPHeaders": headers or {}}}, operation)
+
+
+def _validators(obj: Dict[str, Any]) -> Dict[str, str]:
+    headers = {"etag": obj["ETag"], "last-modified": format_datetime(obj["LastModified"], usegmt=True)}
+    if "CacheControl" in obj:
+        headers["cache-control"] = obj["CacheControl"]
+    return headers
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def read(self) -> bytes:
+        return self._data
+
+    async def iter_chunks(self, chunk_size: int = 64 * 1024):
+        for offset in range(0, len(self._data), chunk_size):
+            await asyncio.sleep(0)
+            yield self._data[offset:offset + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeS3Client:
+    """Подмножество API aiobotocore S3, которое использует S3Service, поверх словаря в памяти"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self._uploads: Dict[str, Dict[int, bytes]] = {}
+        self.meta = SimpleNamespace(events=SimpleNamespace(register=lambda *args, **kwargs: None))
+
+    async def _roundtrip(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    def _store(self, key: str, data: bytes, content_type: Optional[str], **extra: Any) -> Dict[str, Any]:
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        self.objects[key] = {"data": data, "ContentType": content_type or "binary/octet-stream", "ETag": etag,
+                             "LastModified": datetime.now(timezone.utc).replace(microsecond=0), **extra}
+        return {"ETag": etag}
+
+    async def put_object(self, Bucket: str, Key: str, Body, ContentType: Optional[str] = None, **kwargs):
+        await self._roundtrip()
+        data = Body if isinstance(Body, bytes) else Body.read()
+        return self._store(Key, data, ContentType, **kwargs)
+
+    async def head_object(self, Bucket: str, Key: str, **_kwargs):
+        await self._roundtrip()
+        obj = self.objects.get(Key)
+        if obj is None:
+            raise _client_error("404", 404, "HeadObject")
+        return {key: value for key, value in obj.items() if key != "data"} | {"ContentLength": len(obj["data"])}
+
+    async def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None,
+                         IfNoneMatch: Optional[str] = None, IfModifiedSince: Optional[datetime] = None, **_kwargs):
+        await self._roundtrip()
+        obj = self.objects.get(Key)
+        if obj is None:
+            raise _client_error("NoSuchKey", 404, "GetObject")
+        if IfNoneMatch is not None and IfNoneMatch == obj["ETag"]:
+            raise _client_error("304", 304, "GetObject", _validators(obj))
+        if IfModifiedSince is not None and obj["LastModified"] <= IfModifiedSince:
+            raise _client_error("304", 304, "GetObject", _validators(obj))
+        data = obj["data"]
+        resp = {key: value for key, value in obj.items() if key != "data"}
+        if Range is not None:
+            start, _, end = Range.removeprefix("bytes=").partition("-")
+            first = int(start) if start else max(len(data) - int(end), 0)
+            last = min(int(end), len(data) - 1) if start and end else len(data) - 1
+            if first >= len(data):
+                raise _client_error("InvalidRange", 416, "GetObject", {"content-range": f"bytes */{len(data)}"})
+            resp["ContentRange"] = f"bytes {first}-{last}/{len(data)}"
+            data = data[first:last + 1]
+        return resp | {"Body": FakeBody(data), "ContentLength": len(data)}
+
+    async def copy_object(self, Bucket: str, Key: str, CopySource: Dict[str, str], **kwargs):
+        await self._roundtrip()
+        source = self.objects[CopySource["Key"]]
+        kwargs.pop("MetadataDirective", None)
+        content_type = kwargs.pop("ContentType", source["ContentType"])
+        return {"CopyObjectResult": self._store(Key, source["data"], content_type, **kwargs)}
+
+    async def delete_object(self, Bucket: str, Key: str):
+        await self._roundtrip()
+        self.objects.pop(Key, None)
+        return {}
+
+    async def delete_objects(self, Bucket: str, Delete: Dict[str, Any]):
+        await self._roundtrip()
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+        return {}
+
+    async def create_multipart_upload(self, Bucket: str, Key: str, ContentType: Optional[str] = None, **kwargs):
+        await self._roundtrip()
+        upload_id = uuid.uuid4().hex
+        self._uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    async def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes, **_kwargs):
+        await self._roundtrip()
+        self._uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    async def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload, **kwargs):
+        await self._roundtrip()
+        parts = self._uploads.pop(UploadId)
+        data = b"".join(parts[number] for number in sorted(parts))
+        return self._store(Key, data, None)
+
+    async def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str):
+        await self._roundtrip()
+        self._uploads.pop(UploadId, None)
+        return {}
+
+    async def generate_presigned_post(self, Bucket: str, Key: str, Fields=None, Conditions=None, ExpiresIn=3600):
+        return {"url": f"http://fake-s3/{Bucket}", "fields": {**(Fields or {}), "key": Key}}
+
+    async def generate_presigned_url(self, ClientMethod: str, Params: Dict[str, Any], ExpiresIn: int = 3600):
+        return f"http://fake-s3/{Params['Bucket']}/{Params['Key']}?signature=fake"
+
+
+class FakeRabbitMQService(RabbitMQService):
+    """Брокер в памяти: публикации складываются в список, потребители не запускаются"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(url="memory://", queue_name="bench")
+        self.latency = latency
+        self.published: List[Dict[str, Any]] = []
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def is_connected(self) -> bool:
+        return True
+
+    async def publish_message(self, message: Dict[str, Any], routing_key: Optional[str] = None,
+                              persistent: bool = True) -> bool:
+        await asyncio.sleep(self.latency)
+        self.published.append(message)
+        return True
+
+    async def consume_messages(self, callback: callable, auto_ack: bool = False, max_attempts: int = 1) -> str:
+        return "bench-consumer"
+
+    async def consume_raw(self, handler, auto_ack: bool = False) -> str:
+        return "bench-consumer"
+
+    async def cancel_consuming(self, consumer_tag: str) -> None:
+        pass
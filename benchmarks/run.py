@@ -0,0 +1,362 @@
+"""
+Бенчмарк всех маршрутов API внутри одного процесса.
+
+Приложение поднимается через свой же lifespan, но S3 и RabbitMQ подменяются заглушками из benchmarks.fakes,
+а запросы идут через httpx.ASGITransport без сети. Нужна одноразовая база Postgres (маршруты используют
+DML CTE, pg_trgm и JSONB), параметры подключения берутся из тех же переменных окружения, что и у приложения:
+
+    POSTGRES_HOST=localhost POSTGRES_DATABASE=bench python -m benchmarks.run --reset \\
+        --output benchmarks/results/new.json --compare benchmarks/results/base.json
+
+Перед прогоном схема мигрируется, а с --reset таблицы очищаются. Если передан --compare, сценарии,
+у которых p95 вырос или RPS упал больше чем на --threshold, печатаются и процесс завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import platform
+import random
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+import src.app
+from benchmarks.fakes import FakeRabbitMQService, FakeS3Client
+from src.app import App
+from src.cache.cat_cache import cat_cache
+from src.database.migrations import run_migrations
+from src.message_broker.outbox_relay import outbox_relay
+from src.s3.s3_service import S3Service
+from src.settings import settings
+
+COLORS = ("black", "white", "ginger", "grey", "tabby", "calico")
+NAMES = ("Barsik", "Murka", "Vaska", "Pushok", "Ryzhik", "Snezhok", "Tom", "Simba", "Luna", "Felix")
+TABLES = ("cats_images_variants", "cats_images", "cats_images_objects", "cats", "outbox")
+
+
+def make_png(size: int) -> bytes:
+    """Валидный PNG в оттенках серого примерно на size байт (строки шума почти не сжимаются)"""
+    width = 256
+    height = max(size // width, 1)
+    rng = random.Random(size)
+    raw = b"".join(b"\x00" + rng.randbytes(width) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+@dataclass
+class BenchContext:
+    rng: random.Random
+    image: bytes
+    s3: FakeS3Client
+    cat_ids: List[int] = field(default_factory=list)
+    image_ids: List[int] = field(default_factory=list)
+    # Пулы для удаляющих сценариев: каждый запрос забирает свой id
+    disposable_cat_ids: List[int] = field(default_factory=list)
+    disposable_image_ids: List[int] = field(default_factory=list)
+    # Объекты, уже загруженные "клиентом" по подписанной форме: (cat_id, object_name)
+    uploaded_objects: List[Tuple[int, str]] = field(default_factory=list)
+    # ETag котов для условных GET
+    cat_etags: Dict[int, str] = field(default_factory=dict)
+
+    def cat(self) -> Dict:
+        return {"name": self.rng.choice(NAMES) + str(self.rng.randrange(10_000)),
+                "birthday": date(2010 + self.rng.randrange(14), 1 + self.rng.randrange(12),
+                                 1 + self.rng.randrange(28)).isoformat(),
+                "color": self.rng.choice(COLORS)}
+
+
+Call = Callable[[httpx.AsyncClient, BenchContext], Awaitable[httpx.Response]]
+Prepare = Callable[[httpx.AsyncClient, BenchContext, int], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    call: Call
+    prepare: Optional[Prepare] = None
+    # Ответы, которые для сценария считаются успешными
+    expected: tuple = (200,)
+
+
+async def add_cats(client: httpx.AsyncClient, ctx: BenchContext, count: int) -> List[int]:
+    ids = []
+    for offset in range(0, count, 1000):
+        resp = await client.post("/api/cats/batch", json=[ctx.cat() for _ in range(min(1000, count - offset))])
+        resp.raise_for_status()
+        ids.extend(resp.json()["ids"])
+    return ids
+
+
+async def add_image(client: httpx.AsyncClient, ctx: BenchContext, cat_id: int) -> httpx.Response:
+    return await client.post(f"/api/cats_images/{cat_id}", files={"file": ("cat.png", ctx.image, "image/png")})
+
+
+async def add_images(client: httpx.AsyncClient, ctx: BenchContext, count: int) -> List[int]:
+    cat_ids = ctx.rng.sample(ctx.cat_ids, min(count, len(ctx.cat_ids)))
+    for cat_id in cat_ids:
+        (await add_image(client, ctx, cat_id)).raise_for_status()
+    ids = []
+    for cat_id in cat_ids:
+        resp = await client.get(f"/api/cats/{cat_id}")
+        resp.raise_for_status()
+        ids.extend(image["id"] for image in resp.json()["images"])
+    return ids
+
+
+async def prepare_disposable_cats(client: httpx.AsyncClient, ctx: BenchContext, count: int) -> None:
+    ctx.disposable_cat_ids = await add_cats(client, ctx, count)
+
+
+async def prepare_disposable_images(client: httpx.AsyncClient, ctx: BenchContext, count: int) -> None:
+    ctx.disposable_image_ids = await add_images(client, ctx, count)
+
+
+async def request_upload_url(client: httpx.AsyncClient, ctx: BenchContext, cat_id: int) -> httpx.Response:
+    return await client.post(f"/api/cats_images/{cat_id}/upload-url", json={"content_type": "image/png"})
+
+
+async def prepare_uploaded_objects(client: httpx.AsyncClient, ctx: BenchContext, count: int) -> None:
+    for _ in range(count):
+        cat_id = ctx.rng.choice(ctx.cat_ids)
+        resp = await request_upload_url(client, ctx, cat_id)
+        resp.raise_for_status()
+        object_name = resp.json()["object_name"]
+        await ctx.s3.put_object(Bucket="bench", Key=object_name, Body=ctx.image, ContentType="image/png")
+        ctx.uploaded_objects.append((cat_id, object_name))
+
+
+async def complete_upload(client: httpx.AsyncClient, ctx: BenchContext) -> httpx.Response:
+    cat_id, object_name = ctx.uploaded_objects.pop()
+    return await client.post(f"/api/cats_images/{cat_id}/upload-complete", json={"object_name": object_name})
+
+
+async def prepare_cat_etags(client: httpx.AsyncClient, ctx: BenchContext, count: int) -> None:
+    for cat_id in ctx.rng.sample(ctx.cat_ids, min(count, len(ctx.cat_ids), 1000)):
+        resp = await client.get(f"/api/cats/{cat_id}")
+        resp.raise_for_status()
+        ctx.cat_etags[cat_id] = resp.headers["ETag"]
+
+
+async def get_cat_not_modified(client: httpx.AsyncClient, ctx: BenchContext) -> httpx.Response:
+    cat_id, etag = ctx.rng.choice(list(ctx.cat_etags.items()))
+    return await client.get(f"/api/cats/{cat_id}", headers={"If-None-Match": etag})
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("health", lambda client, ctx: client.get("/api/")),
+    Scenario("get_cats", lambda client, ctx: client.get("/api/cats", params={"limit": 50})),
+    Scenario("get_cats_filtered", lambda client, ctx: client.get(
+        "/api/cats", params={"limit": 50, "color": ctx.rng.choice(COLORS), "birthday_from": "2015-01-01"})),
+    Scenario("search_cats", lambda client, ctx: client.get(
+        "/api/cats/search", params={"q": ctx.rng.choice(NAMES)[:4], "limit": 20})),
+    Scenario("export_cats", lambda client, ctx: client.get("/api/cats/export")),
+    Scenario("get_cat", lambda client, ctx: client.get(f"/api/cats/{ctx.rng.choice(ctx.cat_ids)}")),
+    Scenario("get_cat_sized", lambda client, ctx: client.get(
+        f"/api/cats/{ctx.rng.choice(ctx.cat_ids)}", params={"image_size": 256})),
+    Scenario("get_cat_not_modified", get_cat_not_modified, prepare=prepare_cat_etags, expected=(304,)),
+    Scenario("add_cat", lambda client, ctx: client.post("/api/cats", json=ctx.cat())),
+    Scenario("add_cats_batch", lambda client, ctx: client.post(
+        "/api/cats/batch", json=[ctx.cat() for _ in range(100)])),
+    Scenario("put_cat", lambda client, ctx: client.put(
+        f"/api/cats/{ctx.rng.choice(ctx.cat_ids)}", json=ctx.cat())),
+    Scenario("patch_cat", lambda client, ctx: client.patch(
+        f"/api/cats/{ctx.rng.choice(ctx.cat_ids)}", json={"color": ctx.rng.choice(COLORS)})),
+    Scenario("delete_cat", lambda client, ctx: client.delete(f"/api/cats/{ctx.disposable_cat_ids.pop()}"),
+             prepare=prepare_disposable_cats),
+    Scenario("post_image", lambda client, ctx: add_image(client, ctx, ctx.rng.choice(ctx.cat_ids))),
+    Scenario("upload_url", lambda client, ctx: request_upload_url(client, ctx, ctx.rng.choice(ctx.cat_ids))),
+    Scenario("complete_upload", complete_upload, prepare=prepare_uploaded_objects),
+    Scenario("get_image_content", lambda client, ctx: client.get(
+        f"/api/cats_images/{ctx.rng.choice(ctx.image_ids)}/content")),
+    Scenario("get_image_range", lambda client, ctx: client.get(
+        f"/api/cats_images/{ctx.rng.choice(ctx.image_ids)}/content", headers={"Range": "bytes=0-4095"}),
+             expected=(206,)),
+    Scenario("delete_image", lambda client, ctx: client.delete(
+        f"/api/cats_images/{ctx.disposable_image_ids.pop()}"), prepare=prepare_disposable_images),
+    Scenario("stats", lambda client, ctx: client.get("/api/stats")),
+    Scenario("metrics", lambda client, ctx: client.get("/api/metrics")),
+]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(q * len(sorted_values)) - 1, 0)]
+
+
+async def run_scenario(client: httpx.AsyncClient, ctx: BenchContext, scenario: Scenario,
+                       requests: int, concurrency: int, warmup: int) -> Dict[str, float]:
+    if scenario.prepare is not None:
+        await scenario.prepare(client, ctx, requests + warmup)
+    # Cookie last_write_at от наполнения или прошлого сценария направил бы чтения в основную базу
+    # в обход кэша (read-your-writes), и результат зависел бы от того, как быстро начался сценарий
+    client.cookies.clear()
+    for _ in range(warmup):
+        await scenario.call(client, ctx)
+
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker() -> None:
+        nonlocal errors
+        while next(counter) < requests:
+            started = time.perf_counter()
+            resp = await scenario.call(client, ctx)
+            latencies.append(time.perf_counter() - started)
+            if resp.status_code not in scenario.expected:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def prepare_database(reset: bool) -> None:
+    await run_migrations(settings.postgres_url)
+    engine = create_async_engine(settings.postgres_url, poolclass=NullPool)
+    try:
+        async with engine.begin() as conn:
+            if reset:
+                await conn.execute(text(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE"))
+            elif await conn.scalar(text("SELECT EXISTS (SELECT 1 FROM cats)")):
+                raise SystemExit("Database is not empty; point POSTGRES_* at a throwaway database and pass --reset")
+    finally:
+        await engine.dispose()
+
+
+def install_fakes(s3_latency: float, broker_latency: float) -> FakeS3Client:
+    """Подменяет внешние сервисы до старта lifespan, чтобы он поднимал приложение как обычно"""
+    settings.postgres_replica_hosts = []
+    s3_client = FakeS3Client(latency=s3_latency)
+    broker = FakeRabbitMQService(latency=broker_latency)
+    src.app.broker_service = broker
+    outbox_relay.broker = broker
+    cat_cache.broker = broker
+    return s3_client
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    await prepare_database(args.reset)
+    s3_client = install_fakes(args.s3_latency, args.broker_latency)
+    # lifespan увидит уже инициализированный S3Service и пропустит создание настоящего клиента
+    await S3Service.init_s3(bucket_name="bench", endpoint_url="http://fake-s3", external_url="http://fake-s3",
+                            access_key="bench", secret_key="bench",
+                            max_pool_connections=settings.s3_max_pool_connections, client=s3_client)
+
+    selected = [scenario for scenario in SCENARIOS if not args.scenarios or scenario.name in args.scenarios]
+    ctx = BenchContext(rng=random.Random(args.seed), image=make_png(args.image_kb * 1024), s3=s3_client)
+    app = App()
+    results: Dict[str, Dict[str, float]] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ctx.cat_ids = await add_cats(client, ctx, args.seed_cats)
+            ctx.image_ids = await add_images(client, ctx, args.seed_images)
+            for scenario in selected:
+                results[scenario.name] = await run_scenario(client, ctx, scenario, args.requests,
+                                                            args.concurrency, args.warmup)
+                print(f"{scenario.name:<20} {results[scenario.name]}", file=sys.stderr)
+
+    return {"meta": run_meta(args), "results": results}
+
+
+def run_meta(args: argparse.Namespace) -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Список регрессий относительно сохраненного прогона"""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {base['rps']} -> {result['rps']}")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {result['errors']}")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark of all API routes")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--scenarios", nargs="*", choices=[scenario.name for scenario in SCENARIOS])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seed-cats", type=int, default=5000)
+    parser.add_argument("--seed-images", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=64)
+    parser.add_argument("--s3-latency", type=float, default=0.0, help="simulated S3 round trip, seconds")
+    parser.add_argument("--broker-latency", type=float, default=0.0, help="simulated publish confirm, seconds")
+    parser.add_argument("--reset", action="store_true", help="truncate application tables before the run")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative regression")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
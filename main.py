@@ -1,7 +1,12 @@
+import asyncio
 import logging
+import os
+import tempfile
 
 import uvicorn
 from src.app import App
+from src.database.migrations import run_migrations
+from src.metrics.multiprocess import prepare_directory
 from src.settings import settings
 
 app = App()
@@ -9,4 +14,25 @@ app = App()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    uvicorn.run("main:app",  host=settings.host, port=settings.port)
+    if settings.postgres_migrate_on_start:
+        # Один раз в родительском процессе, до старта воркеров
+        asyncio.run(run_migrations(settings.postgres_url))
+    workers = settings.server_worker_count
+    if workers > 1:
+        # Воркеры наследуют окружение: общий каталог снимков, чтобы /api/metrics сводил все процессы
+        metrics_dir = settings.metrics_dir or tempfile.mkdtemp(prefix="cats-metrics-")
+        prepare_directory(metrics_dir)
+        os.environ["METRICS_DIR"] = metrics_dir
+    pool_size, max_overflow = settings.postgres_pool_limits
+    logging.info(f"Starting {workers} workers, Postgres pool {pool_size}+{max_overflow} per worker")
+    # Каждый воркер импортирует main:app и проходит App.lifespan сам: свои пулы Postgres и S3,
+    # подключение к брокеру и локальный кэш. При нескольких воркерах SIGHUP перезапускает их по одному
+    uvicorn.run("main:app",
+                host=settings.host,
+                port=settings.port,
+                workers=workers,
+                loop=settings.server_loop,
+                http=settings.server_http,
+                backlog=settings.server_backlog,
+                timeout_keep_alive=settings.server_keep_alive,
+                timeout_graceful_shutdown=settings.server_graceful_timeout)
@@ -1,6 +1,13 @@
 from fastapi import APIRouter
-from src.api.routes.cats import router as cats_router
+from fastapi.responses import PlainTextResponse
+from src.api.admission import admission_budgets
+from src.api.routes.cats import router as cats_router, cats_page_flight
 from src.api.routes.cats_images import router as cats_images_router
+from src.cache.cat_cache import cat_cache
+from src.database.db_session import AsyncPostgresClient
+from src.metrics import collectors  # noqa: F401 - регистрирует gauge-метрики
+from src.metrics.multiprocess import worker_snapshots
+from src.s3.s3_service import S3Service
 
 main_router = APIRouter(prefix="/api")
 main_router.include_router(cats_router)
@@ -9,4 +16,22 @@ main_router.include_router(cats_images_router)
 
 @main_router.get("/", summary="Health check", tags=["Health check"])
 async def health_check() -> dict:
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+
+def local_stats() -> dict:
+    """Статистика текущего процесса"""
+    return {"cat_cache": cat_cache.stats(), "cats_page_flight": cats_page_flight.stats(), "s3": S3Service.get_stats(),
+            "postgres": AsyncPostgresClient.get_stats(),
+            "admission": {name: budget.stats() for name, budget in admission_budgets.items()}}
+
+
+@main_router.get("/stats", summary="Статистика кэшей и пулов", tags=["Health check"])
+async def stats() -> dict:
+    return worker_snapshots.stats()
+
+
+@main_router.get("/metrics", summary="Метрики в формате Prometheus", tags=["Health check"],
+                 response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(worker_snapshots.render_metrics(), media_type="text/plain; version=0.0.4")
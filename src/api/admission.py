@@ -0,0 +1,141 @@
+import asyncio
+import json
+import re
+from typing import Any, Callable, Dict, Optional
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from src.database.db_session import AsyncPostgresClient
+from src.metrics.registry import admission_rejected_total
+from src.s3.s3_service import S3Service
+from src.settings import settings
+
+# Служебные маршруты должны отвечать и под перегрузкой
+EXEMPT_PATHS = ("/api/", "/api/stats", "/api/metrics", "/docs", "/redoc", "/openapi.json")
+UPLOAD_PATH = re.compile(r"^/api/cats_images/\d+/?$")
+
+
+class Budget:
+    """
+    Ограничение одновременных запросов одного класса с ограниченной очередью и сроком ожидания.
+    Если слотов нет, а нижележащий ресурс уже насыщен, запрос отклоняется сразу, не вставая в очередь.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float,
+                 overloaded: Callable[[], bool] = lambda: False):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.overloaded = overloaded
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> Optional[str]:
+        """None - запрос допущен, иначе причина отказа"""
+        if not self._slots.locked():
+            await self._slots.acquire()
+            self.in_flight += 1
+            return None
+        if self.overloaded():
+            return "overloaded"
+        if self.waiting >= self.queue_size:
+            return "queue_full"
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return "timeout"
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return None
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting,
+                "queue_size": self.queue_size}
+
+
+def create_budgets() -> Dict[str, Budget]:
+    timeout = settings.admission_queue_timeout
+    return {
+        "read": Budget("read", settings.admission_read_limit, settings.admission_read_queue, timeout,
+                       overloaded=lambda: AsyncPostgresClient.is_saturated(read=True)),
+        "write": Budget("write", settings.admission_write_limit, settings.admission_write_queue, timeout,
+                        overloaded=AsyncPostgresClient.is_saturated),
+        "upload": Budget("upload", settings.admission_upload_limit, settings.admission_upload_queue, timeout,
+                         overloaded=lambda: S3Service.is_saturated() or AsyncPostgresClient.is_saturated()),
+    }
+
+
+def classify(scope: Scope) -> str:
+    method = scope["method"]
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    if method == "POST" and UPLOAD_PATH.match(scope["path"]):
+        return "upload"
+    return "write"
+
+
+class AdmissionMiddleware:
+    """
+    Допуск запросов по бюджетам чтения, записи и загрузки картинок. Вместо неограниченного ожидания
+    соединения в пуле Postgres или S3 лишние запросы быстро получают 503 с Retry-After.
+    """
+
+    def __init__(self, app: ASGIApp, budgets: Optional[Dict[str, Budget]] = None):
+        self.app = app
+        self.budgets = budgets if budgets is not None else admission_budgets
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        budget = self.budgets[classify(scope)]
+        reason = await budget.acquire()
+        if reason is not None:
+            admission_rejected_total.inc(budget.name, reason)
+            self._resolve_route(scope)
+            await self._reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            budget.release()
+
+    @staticmethod
+    def _resolve_route(scope: Scope) -> None:
+        """
+        Отклоненный запрос не доходит до роутера, поэтому шаблон маршрута для метрик
+        ищется здесь же: иначе все 503 под перегрузкой попали бы в route="unmatched"
+        """
+        app = scope.get("app")
+        for route in getattr(getattr(app, "router", None), "routes", ()):
+            match, _child_scope = route.matches(scope)
+            if match == Match.FULL:
+                scope["route"] = route
+                return
+
+    @staticmethod
+    async def _reject(send: Send) -> None:
+        body = json.dumps({"detail": "Сервис перегружен, повторите запрос позже"}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.admission_retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+admission_budgets = create_budgets()
@@ -5,4 +5,5 @@ from src.database import db_session
 from src.message_broker.broker_service import RabbitMQService, get_rabbitmq_service
 
 SessionDepend = Annotated[AsyncSession, Depends(db_session.create_session)]
+ReadSessionDepend = Annotated[AsyncSession, Depends(db_session.create_read_session)]
 BrokerDepend = Annotated[RabbitMQService, Depends(get_rabbitmq_service)]
\ No newline at end of file
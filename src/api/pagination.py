@@ -0,0 +1,28 @@
+import base64
+import binascii
+from typing import Optional
+
+from fastapi import HTTPException
+
+# id котов - INTEGER: значения вне диапазона asyncpg отклоняет уже при выполнении запроса
+MAX_ID = 2 ** 31 - 1
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, value = raw.split(":", 1)
+        if prefix != "id":
+            raise ValueError(prefix)
+        last_id = int(value)
+        if not 1 <= last_id <= MAX_ID:
+            raise ValueError(value)
+        return last_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="Некорректный курсор")
@@ -1,3 +1,9 @@
+from typing import Optional
+
+from fastapi import Response
+from pydantic import BaseModel
+
+
 def response404(description: str, message: str):
     return {404:
         {
@@ -11,3 +17,18 @@ def response404(description: str, message: str):
             }
         }
     }
+
+
+def model_response(model: BaseModel, response: Optional[Response] = None) -> Response:
+    """
+    JSON-ответ из уже провалидированной схемы. Готовый Response FastAPI не проверяет повторно,
+    а model_dump_json сериализует модель в pydantic-core, минуя jsonable_encoder и json.dumps.
+    Маршрут при этом объявляет схему через response_model, чтобы она осталась в OpenAPI.
+    Заголовки, выставленные зависимостями в response (cookie last_write_at), FastAPI к готовому ответу
+    не добавляет, поэтому маршрут передает response сюда
+    """
+    result = Response(content=model.model_dump_json(), media_type="application/json")
+    if response is not None:
+        result.raw_headers.extend((name, value) for name, value in response.raw_headers
+                                  if name not in (b"content-length", b"content-type"))
+    return result
@@ -1,92 +1,370 @@
-from typing import List, Annotated, Optional
+import hashlib
+from datetime import date, datetime
+from typing import Annotated, Any, AsyncIterator, Dict, List, Optional, Set, Sequence, Tuple
 
-from fastapi import APIRouter, Path, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter, Body, Path, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, update, delete, func, text, true, FromClause, JSON, Select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
+from pydantic import TypeAdapter
 
-from src.api.dependencies import SessionDepend, BrokerDepend
-from src.api.responsies import response404
-from src.models import CatModel
-from src.schemes import CatScheme, CatFullScheme, CatAddScheme, CatPatchScheme, SuccessScheme
+from src.api.conditional import is_not_modified, not_modified_response, validator_headers
+from src.api.dependencies import SessionDepend, ReadSessionDepend
+from src.api.pagination import encode_cursor, decode_cursor
+from src.api.responsies import response404, model_response
+from src.cache.cat_cache import cat_cache, CachedCat
+from src.cache.single_flight import SingleFlight
+from src.database.db_session import AsyncPostgresClient, recently_wrote
+from src.database.versions import bumped
+from src.images.storage import release_objects
+from src.images.thumbnails import fitting_size
+from src.message_broker.outbox_relay import outbox_relay
+from src.models import CatModel, CatImageModel, CatImageVariantModel
+from src.s3.reaper import s3_reaper
+from src.schemes import (CatScheme, CatFullScheme, CatImageScheme, CatAddScheme, CatPatchScheme, CatPageScheme,
+                         CatIdsScheme, CatSearchScheme, CatSearchHitScheme, SuccessScheme)
+from src.settings import settings
 
 router = APIRouter(tags=["Cats"], prefix="/cats")
 
+# Строки выборки проверяются один раз по атрибутам, без промежуточных ORM-объектов и словарей
+_cats_adapter = TypeAdapter(List[CatScheme])
+_search_hits_adapter = TypeAdapter(List[CatSearchHitScheme])
+
+# Одинаковые одновременные запросы страниц выполняют один запрос к базе на процесс
+cats_page_flight = SingleFlight("cats_page")
+
+
+def _page_etag(rows: Sequence[Any], limit: int) -> str:
+    """Страница однозначно определяется id и версиями своих строк и наличием следующей страницы"""
+    digest = hashlib.sha1()
+    for row in rows[:limit]:
+        digest.update(f"{row.id}:{row.version};".encode())
+    if len(rows) > limit:
+        digest.update(b"+")
+    return f'"{digest.hexdigest()}"'
+
+
+async def _load_cats_page(query: Select, limit: int, use_primary: bool) -> Tuple[bytes, str]:
+    # Своя сессия: загрузку делят несколько запросов, и она не должна зависеть от жизни первого из них
+    async_session_maker = AsyncPostgresClient.get_read_session(use_primary=use_primary)
+    async with async_session_maker() as session:
+        cats = (await session.execute(query)).all()
+    next_cursor = encode_cursor(cats[limit - 1].id) if len(cats) > limit else None
+    items = _cats_adapter.validate_python(cats[:limit], from_attributes=True)
+    return CatPageScheme(items=items, next_cursor=next_cursor).model_dump_json().encode(), _page_etag(cats, limit)
+
 
 @router.get("",
-            summary="Получить всех котов")
-async def get_cats(session: SessionDepend) -> List[CatScheme]:
-    query = select(CatModel).order_by(CatModel.id)
-    res = await session.execute(query)
-    cats = res.scalars().all()
-    cats_schemes = [CatScheme.model_validate(cat) for cat in cats]
-    return cats_schemes
+            summary="Получить котов постранично",
+            response_model=CatPageScheme)
+async def get_cats(request: Request,
+                   limit: Annotated[int, Query(ge=1, le=500)] = 50,
+                   cursor: Optional[str] = None,
+                   color: Optional[str] = None,
+                   name: Annotated[Optional[str], Query(min_length=1)] = None,
+                   birthday_from: Optional[date] = None,
+                   birthday_to: Optional[date] = None,
+                   if_none_match: Annotated[Optional[str], Header()] = None) -> Response:
+    query = (
+        select(CatModel.id, CatModel.name, CatModel.birthday, CatModel.color, CatModel.version)
+        .order_by(CatModel.id)
+        .limit(limit + 1)
+    )
+    last_id = decode_cursor(cursor)
+    if last_id is not None:
+        query = query.filter(CatModel.id > last_id)
+    if color is not None:
+        query = query.filter(CatModel.color == color)
+    if name is not None:
+        query = query.filter(CatModel.name.startswith(name, autoescape=True))
+    if birthday_from is not None:
+        query = query.filter(CatModel.birthday >= birthday_from)
+    if birthday_to is not None:
+        query = query.filter(CatModel.birthday <= birthday_to)
+    use_primary = recently_wrote(request)
+    if if_none_match is not None:
+        # Та же выборка, но только id и версии: без сериализации и чтения остальных колонок.
+        # If-Modified-Since для страниц не поддерживается: удаление кота не оставляет updated_at
+        async_session_maker = AsyncPostgresClient.get_read_session(use_primary=use_primary)
+        async with async_session_maker() as session:
+            rows = (await session.execute(query.with_only_columns(CatModel.id, CatModel.version))).all()
+        etag = _page_etag(rows, limit)
+        if is_not_modified(etag, None, if_none_match, None):
+            return not_modified_response(etag)
+    key = (limit, last_id, color, name, birthday_from, birthday_to, use_primary)
+    payload, etag = await cats_page_flight.do(key, lambda: _load_cats_page(query, limit, use_primary))
+    return Response(content=payload, media_type="application/json", headers=validator_headers(etag))
+
+
+@router.get("/search",
+            summary="Поиск котов по имени с фасетами по цвету",
+            response_model=CatSearchScheme)
+async def search_cats(session: ReadSessionDepend,
+                      q: Annotated[str, Query(min_length=1, max_length=100)],
+                      color: Optional[str] = None,
+                      birthday_from: Optional[date] = None,
+                      birthday_to: Optional[date] = None,
+                      limit: Annotated[int, Query(ge=1, le=100)] = 20) -> Response:
+    # name % q использует триграммный GIN-индекс; фасеты считаются по всем совпадениям
+    # без фильтра по цвету и возвращаются тем же запросом, что и найденные коты
+    matched = (
+        select(CatModel.id, CatModel.name, CatModel.birthday, CatModel.color,
+               func.similarity(CatModel.name, q).label("rank"))
+        .filter(CatModel.name.op("%")(q))
+    )
+    if birthday_from is not None:
+        matched = matched.filter(CatModel.birthday >= birthday_from)
+    if birthday_to is not None:
+        matched = matched.filter(CatModel.birthday <= birthday_to)
+    matched = matched.cte("matched")
+
+    hits = select(matched).order_by(matched.c.rank.desc(), matched.c.id).limit(limit)
+    if color is not None:
+        hits = hits.filter(matched.c.color == color)
+    hits = hits.subquery("hits")
+    facet_counts = (
+        select(matched.c.color, func.count().label("cats"))
+        .group_by(matched.c.color)
+        .subquery("facet_counts")
+    )
+    facets = select(
+        func.coalesce(func.json_object_agg(facet_counts.c.color, facet_counts.c.cats), text("'{}'::json"),
+                      type_=JSON).label("facets")
+    ).subquery("facets")
+    query = (
+        select(facets.c.facets, hits)
+        .select_from(facets.outerjoin(hits, true()))
+        .order_by(hits.c.rank.desc(), hits.c.id)
+    )
+    rows = (await session.execute(query)).all()
+    items = _search_hits_adapter.validate_python([row for row in rows if row.id is not None], from_attributes=True)
+    return model_response(CatSearchScheme(items=items, facets=rows[0].facets))
+
+
+async def _export_cats_ndjson(chunk_rows: int = 500) -> AsyncIterator[bytes]:
+    query = (
+        select(CatModel.id, CatModel.name, CatModel.birthday, CatModel.color,
+               CatImageModel.id.label("image_id"), CatImageModel.image_url)
+        .outerjoin(CatImageModel, CatImageModel.cat_id == CatModel.id)
+        .order_by(CatModel.id, CatImageModel.id)
+        .execution_options(yield_per=chunk_rows)
+    )
+    # Сессия открывается внутри генератора: зависимости закрываются до отправки тела ответа
+    async_session_maker = AsyncPostgresClient.get_read_session()
+    async with async_session_maker() as session:
+        res = await session.stream(query)
+        current: Optional[CatFullScheme] = None
+        buffer: List[str] = []
+        async for partition in res.partitions():
+            for row in partition:
+                if current is None or current.id != row.id:
+                    if current is not None:
+                        buffer.append(current.model_dump_json())
+                    current = CatFullScheme(id=row.id, name=row.name, birthday=row.birthday,
+                                            color=row.color, images=[])
+                if row.image_id is not None:
+                    current.images.append(CatImageScheme(id=row.image_id, cat_id=row.id,
+                                                         image_url=row.image_url))
+            if buffer:
+                yield ("\n".join(buffer) + "\n").encode()
+                buffer.clear()
+        if current is not None:
+            yield (current.model_dump_json() + "\n").encode()
+
+
+@router.get("/export",
+            summary="Выгрузить всех котов с картинками в NDJSON",
+            response_class=StreamingResponse)
+async def export_cats() -> StreamingResponse:
+    return StreamingResponse(_export_cats_ndjson(), media_type="application/x-ndjson")
+
+
+def _cat_etag(cat_id: int, version: int, variant_width: Optional[int]) -> str:
+    # Размер картинок входит в тег: для одной версии кота это разные представления
+    return f'"cat-{cat_id}-{version}-{variant_width or 0}"'
+
+
+async def _load_cat(cat_id: int, variant_width: Optional[int], use_primary: bool) -> Optional[CachedCat]:
+    images_loader = selectinload(CatModel.images)
+    if variant_width is not None:
+        images_loader = images_loader.selectinload(CatImageModel.variants)
+    query = select(CatModel).options(images_loader).filter(CatModel.id == cat_id)
+    async_session_maker = AsyncPostgresClient.get_read_session(use_primary=use_primary)
+    async with async_session_maker() as session:
+        res = await session.execute(query)
+        db_cat: Optional[CatModel] = res.scalar()
+        if db_cat is None:
+            return None
+        cat = CatFullScheme.model_validate(db_cat)
+        if variant_width is not None:
+            for image, db_image in zip(cat.images, db_cat.images):
+                variant = next((v for v in db_image.variants if v.width >= variant_width), None)
+                if variant is not None:
+                    image.image_url = variant.image_url
+    return CachedCat(cat.model_dump_json().encode(), db_cat.version, db_cat.updated_at)
+
+
+async def _cat_version(cat_id: int, use_primary: bool) -> Optional[Tuple[int, datetime]]:
+    query = select(CatModel.version, CatModel.updated_at).filter(CatModel.id == cat_id)
+    async_session_maker = AsyncPostgresClient.get_read_session(use_primary=use_primary)
+    async with async_session_maker() as session:
+        row = (await session.execute(query)).first()
+    return None if row is None else (row.version, row.updated_at)
 
 
 @router.get("/{cat_id}",
             summary="Получить кота по id",
+            response_model=CatFullScheme,
             responses=response404("Кот не найден", "Кот  с cat_id=1 не найден"))
-async def get_cat(cat_id: Annotated[int, Path(ge=1)], session: SessionDepend) -> CatFullScheme:
-    query = select(CatModel).options(selectinload(CatModel.images)).filter(CatModel.id == cat_id)
-    res = await session.execute(query)
-    db_cat: Optional[CatModel] = res.scalar()
-    if db_cat is None:
+async def get_cat(cat_id: Annotated[int, Path(ge=1)], request: Request,
+                  image_size: Annotated[Optional[int], Query(ge=1)] = None,
+                  if_none_match: Annotated[Optional[str], Header()] = None,
+                  if_modified_since: Annotated[Optional[str], Header()] = None) -> Response:
+    variant_width = fitting_size(image_size, settings.thumbnail_sizes)
+    use_primary = recently_wrote(request)
+    # Запись в кэше могла быть загружена с отстающей реплики сразу после инвалидации: писавший клиент
+    # читает из основной базы, а его загрузка заменяет запись в кэше
+    payload = None if use_primary else cat_cache.get(cat_id, variant_width)
+    if payload is None and (if_none_match is not None or if_modified_since is not None):
+        # Версия по первичному ключу вместо загрузки картинок и сериализации
+        version = await _cat_version(cat_id, use_primary)
+        if version is None:
+            raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
+        etag = _cat_etag(cat_id, version[0], variant_width)
+        if is_not_modified(etag, version[1], if_none_match, if_modified_since):
+            return not_modified_response(etag, version[1])
+    if payload is None:
+        payload = await cat_cache.load(cat_id, variant_width, lambda: _load_cat(cat_id, variant_width, use_primary),
+                                       use_primary=use_primary)
+    if payload is None:
         raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
-    return CatFullScheme.model_validate(db_cat)
+    etag = _cat_etag(cat_id, payload.version, variant_width)
+    if is_not_modified(etag, payload.updated_at, if_none_match, if_modified_since):
+        return not_modified_response(etag, payload.updated_at)
+    return Response(content=payload.body, media_type="application/json",
+                    headers=validator_headers(etag, payload.updated_at))
 
 
 @router.post("", summary="Добавить кота")
-async def add_cat(cat: CatAddScheme, session: SessionDepend, broker: BrokerDepend) -> SuccessScheme:
+async def add_cat(cat: CatAddScheme, session: SessionDepend) -> SuccessScheme:
     db_cat = CatModel(name=cat.name, birthday=cat.birthday, color=cat.color)
     session.add(db_cat)
+    await session.flush()
+    outbox_relay.add_message(session, {"event": "cat_added", "message": "Кот добавлен", "cat_id": db_cat.id})
     await session.commit()
-    await broker.publish_message({"message": "Кот добавлен", "cat_id": db_cat.id})
+    outbox_relay.notify()
     return SuccessScheme()
 
 
+@router.post("/batch", summary="Добавить нескольких котов")
+async def add_cats_batch(cats: Annotated[List[CatAddScheme], Body(min_length=1, max_length=10_000)],
+                         session: SessionDepend) -> CatIdsScheme:
+    query = insert(CatModel).returning(CatModel.id, sort_by_parameter_order=True)
+    res = await session.scalars(query, [cat.model_dump() for cat in cats])
+    ids = list(res.all())
+    outbox_relay.add_message(session, {"event": "cats_added", "message": "Коты добавлены", "cat_ids": ids})
+    await session.commit()
+    outbox_relay.notify()
+    return CatIdsScheme(ids=ids)
+
+
+async def _cat_with_images(session: AsyncSession, cats: FromClause) -> Optional[CatFullScheme]:
+    """Кот из cats (подзапрос или CTE с RETURNING) вместе с картинками за один запрос"""
+    query = (
+        select(cats.c.id, cats.c.name, cats.c.birthday, cats.c.color,
+               CatImageModel.id.label("image_id"), CatImageModel.image_url)
+        .outerjoin(CatImageModel, CatImageModel.cat_id == cats.c.id)
+        .order_by(CatImageModel.id)
+    )
+    rows = (await session.execute(query)).all()
+    if not rows:
+        return None
+    first = rows[0]
+    images = [CatImageScheme(id=row.image_id, cat_id=row.id, image_url=row.image_url)
+              for row in rows if row.image_id is not None]
+    return CatFullScheme(id=first.id, name=first.name, birthday=first.birthday, color=first.color, images=images)
+
+
+async def _update_cat(session: AsyncSession, cat_id: int, values: Dict[str, Any]) -> CatFullScheme:
+    cats_table = CatModel.__table__
+    if values:
+        cats = (
+            update(cats_table)
+            .filter(cats_table.c.id == cat_id)
+            .values(**values, **bumped(cats_table.c))
+            .returning(cats_table.c.id, cats_table.c.name, cats_table.c.birthday, cats_table.c.color)
+            .cte("updated_cat")
+        )
+    else:
+        cats = select(cats_table).filter(cats_table.c.id == cat_id).subquery("cat")
+    cat = await _cat_with_images(session, cats)
+    if cat is None:
+        raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
+    await session.commit()
+    await cat_cache.invalidate(cat_id)
+    return cat
+
+
 @router.put("/{cat_id}",
             summary="Изменить все данные кота",
+            response_model=CatFullScheme,
             responses=response404("Кот не найден", "Кот  с cat_id=1 не найден"))
-async def put_cat(cat_id: Annotated[int, Path(ge=1)], cat: CatAddScheme, session: SessionDepend) -> CatFullScheme:
-    query = select(CatModel).options(selectinload(CatModel.images)).filter(CatModel.id == cat_id)
-    res = await session.execute(query)
-    db_cat: Optional[CatModel] = res.scalar()
-    if db_cat is None:
-        raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
-    db_cat.birthday = cat.birthday
-    db_cat.color = cat.color
-    db_cat.name = cat.name
-    await session.commit()
-    return CatFullScheme.model_validate(db_cat)
+async def put_cat(cat_id: Annotated[int, Path(ge=1)], cat: CatAddScheme, session: SessionDepend,
+                  response: Response) -> Response:
+    return model_response(await _update_cat(session, cat_id, cat.model_dump()), response)
 
 
 @router.patch("/{cat_id}",
               summary="Изменить часть данных кота",
+              response_model=CatFullScheme,
               responses=response404("Кот не найден", "Кот  с cat_id=1 не найден"))
-async def patch_cat(cat_id: Annotated[int, Path(ge=1)], cat: CatPatchScheme, session: SessionDepend) -> CatFullScheme:
-    query = select(CatModel).options(selectinload(CatModel.images)).filter(CatModel.id == cat_id)
-    res = await session.execute(query)
-    db_cat: Optional[CatModel] = res.scalar()
-    if db_cat is None:
-        raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
-    if cat.birthday:
-        db_cat.birthday = cat.birthday
-    if cat.color:
-        db_cat.color = cat.color
-    if cat.name:
-        db_cat.name = cat.name
-    await session.commit()
-    return CatFullScheme.model_validate(db_cat)
+async def patch_cat(cat_id: Annotated[int, Path(ge=1)], cat: CatPatchScheme, session: SessionDepend,
+                    response: Response) -> Response:
+    values = cat.model_dump(exclude_unset=True)
+    null_fields = [field for field, value in values.items() if value is None]
+    if null_fields:
+        raise HTTPException(status_code=422, detail=f"Поля {null_fields} не могут быть null")
+    return model_response(await _update_cat(session, cat_id, values), response)
 
 
 @router.delete("/{cat_id}",
                summary="Удалить кота",
+               response_model=CatFullScheme,
                responses=response404("Кот не найден", "Кот  с cat_id=1 не найден"))
-async def delete_cat(cat_id: Annotated[int, Path(ge=1)], session: SessionDepend) -> CatFullScheme:
-    query = select(CatModel).options(selectinload(CatModel.images)).filter(CatModel.id == cat_id)
-    res = await session.execute(query)
-    db_cat: Optional[CatModel] = res.scalar()
-    if db_cat is None:
+async def delete_cat(cat_id: Annotated[int, Path(ge=1)], session: SessionDepend, response: Response) -> Response:
+    # Картинки и их копии удаляет ON DELETE CASCADE; основной запрос видит снимок
+    # таблиц до удаления, поэтому ссылки на объекты S3 достаются тем же запросом
+    deleted_cat = (
+        delete(CatModel)
+        .filter(CatModel.id == cat_id)
+        .returning(CatModel.id, CatModel.name, CatModel.birthday, CatModel.color)
+        .cte("deleted_cat")
+    )
+    query = (
+        select(deleted_cat, CatImageModel.id.label("image_id"), CatImageModel.image_url,
+               CatImageVariantModel.image_url.label("variant_url"))
+        .outerjoin(CatImageModel, CatImageModel.cat_id == deleted_cat.c.id)
+        .outerjoin(CatImageVariantModel, CatImageVariantModel.image_id == CatImageModel.id)
+        .order_by(CatImageModel.id)
+    )
+    rows = (await session.execute(query)).all()
+    if not rows:
         raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
-    await session.delete(db_cat)
+
+    images: Dict[int, CatImageScheme] = {}
+    variant_urls: Dict[str, Set[str]] = {}
+    for row in rows:
+        if row.image_id is not None and row.image_id not in images:
+            images[row.image_id] = CatImageScheme(id=row.image_id, cat_id=row.id, image_url=row.image_url)
+        if row.variant_url is not None:
+            variant_urls.setdefault(row.image_url, set()).add(row.variant_url)
+    # Объекты с тем же содержимым могут принадлежать другим котам: удаляются только те, на которые не осталось ссылок
+    unused = await release_objects(session, [image.image_url for image in images.values()])
     await session.commit()
-    return CatFullScheme.model_validate(db_cat)
+    s3_reaper.enqueue_released({image_url: variant_urls.get(image_url, ()) for image_url in unused})
+    await cat_cache.invalidate(cat_id)
+    first = rows[0]
+    return model_response(CatFullScheme(id=first.id, name=first.name, birthday=first.birthday, color=first.color,
+                                        images=list(images.values())), response)
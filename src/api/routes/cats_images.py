@@ -1,21 +1,47 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Path
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import APIRouter, UploadFile, HTTPException, Path, Header, Response
+from fastapi.responses import StreamingResponse
 from typing import Annotated, Optional
 import uuid
+from botocore.exceptions import ClientError
 from sqlalchemy import select, delete
-from src.api.dependencies import SessionDepend
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.api.dependencies import SessionDepend, ReadSessionDepend
 from src.api.responsies import response404
-from src.models import CatModel, CatImageModel
+from src.cache.cat_cache import cat_cache
+from src.database.versions import touch_cat
+from src.images.storage import (IMAGE_EXTENSIONS, IMMUTABLE_CACHE_CONTROL, ImageTooLargeError, store_image,
+                                acquire_object, release_objects)
+from src.message_broker.outbox_relay import outbox_relay
+from src.models import CatModel, CatImageModel, CatImageVariantModel
+from src.s3.reaper import s3_reaper
 from src.s3.s3_service import S3Service
-from src.schemes import CatImageURLScheme, SuccessScheme
+from src.schemes import (CatImageURLScheme, CatImageUploadScheme, CatImageUploadURLScheme,
+                         CatImageUploadCompleteScheme, SuccessScheme)
+from src.settings import settings
 
 router = APIRouter(tags=["Cats Images"], prefix="/cats_images")
 
+async def _add_image(session: AsyncSession, cat_id: int, object_name: str, content_type: str) -> str:
+    """Строка картинки и событие для генерации миниатюр в одной транзакции"""
+    url = S3Service.object_url(object_name)
+    cat_image: CatImageModel = CatImageModel(cat_id=cat_id, image_url=url)
+    session.add(cat_image)
+    await session.flush()
+    outbox_relay.add_message(session, {"event": "image_uploaded", "image_id": cat_image.id, "cat_id": cat_id,
+                                       "object_name": object_name, "content_type": content_type})
+    await touch_cat(session, cat_id)
+    await session.commit()
+    outbox_relay.notify()
+    await cat_cache.invalidate(cat_id)
+    return url
+
 
 @router.post("/{cat_id}",
              summary="Добавить картинку кота",
              responses=response404("Кот не найден", "Кот  с cat_id=1 не найден"))
 async def post_image(cat_id: Annotated[int, Path(ge=1)], file: UploadFile, session: SessionDepend) -> CatImageURLScheme:
-    if file.content_type not in ("image/png", "image/jpeg", "image/svg+xml", "image/gif"):
+    if file.content_type not in IMAGE_EXTENSIONS:
         raise HTTPException(status_code=422, detail="Файл должен являться изображением")
 
     query = select(CatModel).filter(CatModel.id == cat_id)
@@ -24,18 +50,156 @@ async def post_image(cat_id: Annotated[int, Path(ge=1)], file: UploadFile, sessi
     if cat is None:
         raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
 
-    filename = f"{uuid.uuid4()}.png"
-    url = await S3Service.upload_file_object(content=file.file, object_name=filename)
-    cat_image: CatImageModel = CatImageModel(cat_id=cat_id, image_url=url)
-    session.add(cat_image)
-    await session.commit()
+    try:
+        stored = await store_image(session, file, part_size=settings.s3_part_size,
+                                   concurrency=settings.s3_upload_concurrency, max_size=settings.image_max_size)
+    except ImageTooLargeError:
+        raise HTTPException(status_code=413, detail=f"Файл больше {settings.image_max_size} байт")
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Файл должен являться изображением")
+    url = await _add_image(session, cat_id, stored["object_name"], stored["content_type"])
 
     return CatImageURLScheme(image_url=url)
 
 
+@router.post("/{cat_id}/upload-url",
+             summary="Получить форму для загрузки картинки кота напрямую в S3",
+             responses=response404("Кот не найден", "Кот  с cat_id=1 не найден"))
+async def create_upload_url(cat_id: Annotated[int, Path(ge=1)], upload: CatImageUploadScheme,
+                            session: ReadSessionDepend) -> CatImageUploadURLScheme:
+    res = await session.execute(select(CatModel.id).filter(CatModel.id == cat_id))
+    if res.scalar() is None:
+        raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
+
+    object_name = f"uploads/{cat_id}/{uuid.uuid4()}{IMAGE_EXTENSIONS[upload.content_type]}"
+    presigned = await S3Service.generate_upload_post(object_name, upload.content_type,
+                                                     max_size=settings.image_max_size,
+                                                     expires_in=settings.s3_upload_url_ttl,
+                                                     cache_control=IMMUTABLE_CACHE_CONTROL)
+    return CatImageUploadURLScheme(url=presigned["url"], fields=presigned["fields"], object_name=object_name,
+                                   expires_in=settings.s3_upload_url_ttl)
+
+
+@router.post("/{cat_id}/upload-complete",
+             summary="Зарегистрировать картинку, загруженную напрямую в S3",
+             responses=response404("Кот или загруженный объект не найден", "Кот  с cat_id=1 не найден"))
+async def complete_upload(cat_id: Annotated[int, Path(ge=1)], upload: CatImageUploadCompleteScheme,
+                          session: SessionDepend) -> CatImageURLScheme:
+    # Ключ выдает сервер, поэтому чужой префикс означает подделанный запрос
+    if not upload.object_name.startswith(f"uploads/{cat_id}/"):
+        raise HTTPException(status_code=422, detail="Объект загружен не для этого кота")
+
+    url = S3Service.object_url(upload.object_name)
+    res = await session.execute(select(CatImageModel.id).filter(CatImageModel.image_url == url))
+    if res.scalar() is not None:
+        return CatImageURLScheme(image_url=url)  # повторное подтверждение той же загрузки
+
+    head = await S3Service.head_file_object(upload.object_name)
+    if head is None:
+        raise HTTPException(status_code=404, detail="Загруженный объект не найден")
+    # Политика формы уже ограничивает тип и размер, но объект проверяется по фактическим метаданным
+    if head.get("ContentType") not in IMAGE_EXTENSIONS or head["ContentLength"] > settings.image_max_size:
+        s3_reaper.enqueue([upload.object_name])
+        raise HTTPException(status_code=422, detail="Файл должен являться изображением допустимого размера")
+
+    res = await session.execute(select(CatModel.id).filter(CatModel.id == cat_id))
+    if res.scalar() is None:
+        s3_reaper.enqueue([upload.object_name])
+        raise HTTPException(status_code=404, detail=f"Кот с {cat_id=} не найден!")
+    await acquire_object(session, url)
+    url = await _add_image(session, cat_id, upload.object_name, head["ContentType"])
+
+    return CatImageURLScheme(image_url=url)
+
+
+# Заголовки ответа S3, которые 304 обязан повторить вместо тела (RFC 9110, 15.4.5)
+NOT_MODIFIED_HEADERS = {"etag": "ETag", "last-modified": "Last-Modified", "cache-control": "Cache-Control",
+                        "expires": "Expires", "vary": "Vary"}
+
+
+async def _storage_status_response(image_url: str, status_code: int, storage_headers: dict) -> Response:
+    """Ответ без тела на 304/412/416 хранилища с заголовками, которые нужны клиенту и кэшам"""
+    headers = {}
+    if status_code == 304:
+        headers = {name: storage_headers[key] for key, name in NOT_MODIFIED_HEADERS.items() if key in storage_headers}
+    elif status_code == 416:
+        content_range = storage_headers.get("content-range")
+        if content_range is None:
+            head = await S3Service.head_file_object(S3Service.object_name_from_url(image_url))
+            if head is not None:
+                content_range = f"bytes */{head['ContentLength']}"
+        if content_range is not None:
+            headers["Content-Range"] = content_range
+    return Response(status_code=status_code, headers=headers)
+
+
+@router.get("/{image_id}/content",
+            summary="Получить содержимое изображения",
+            response_class=StreamingResponse,
+            responses=response404("Изображение не найдено", "Изображение с image_id=1 не найдено"))
+async def get_image_content(image_id: Annotated[int, Path(ge=1)], session: ReadSessionDepend,
+                            range_header: Annotated[Optional[str], Header(alias="Range")] = None,
+                            if_none_match: Annotated[Optional[str], Header()] = None,
+                            if_modified_since: Annotated[Optional[str], Header()] = None) -> Response:
+    query = select(CatImageModel.image_url).filter(CatImageModel.id == image_id)
+    res = await session.execute(query)
+    image_url: Optional[str] = res.scalar()
+    if image_url is None:
+        raise HTTPException(status_code=404, detail=f"Изображение с {image_id=} не найдено!")
+
+    modified_since = None
+    if if_modified_since is not None and if_none_match is None:
+        try:
+            modified_since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        obj = await S3Service.open_file_stream(S3Service.object_name_from_url(image_url),
+                                               range_header=range_header,
+                                               if_none_match=if_none_match,
+                                               if_modified_since=modified_since)
+    except ClientError as e:
+        status_code = e.response["ResponseMetadata"]["HTTPStatusCode"]
+        if status_code in (304, 412, 416):
+            return await _storage_status_response(image_url, status_code,
+                                                  e.response["ResponseMetadata"].get("HTTPHeaders", {}))
+        raise
+    if obj is None:
+        raise HTTPException(status_code=404, detail=f"Изображение с {image_id=} не найдено!")
+
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(obj["ContentLength"]), "ETag": obj["ETag"],
+               "Last-Modified": format_datetime(obj["LastModified"], usegmt=True)}
+    if "ContentRange" in obj:
+        headers["Content-Range"] = obj["ContentRange"]
+    if "CacheControl" in obj:
+        headers["Cache-Control"] = obj["CacheControl"]
+    return StreamingResponse(S3Service.iter_body(obj["Body"]),
+                             status_code=206 if "ContentRange" in obj else 200,
+                             media_type=obj.get("ContentType", "application/octet-stream"),
+                             headers=headers)
+
+
 @router.delete("/{image_id}", summary="Удалить изображение")
 async def delete_image(image_id: Annotated[int, Path(ge=1)], session: SessionDepend) -> SuccessScheme:
-    query = delete(CatImageModel).filter(CatImageModel.id == image_id)
-    await session.execute(query)
+    deleted_image = (
+        delete(CatImageModel)
+        .filter(CatImageModel.id == image_id)
+        .returning(CatImageModel.id, CatImageModel.cat_id, CatImageModel.image_url)
+        .cte("deleted_image")
+    )
+    query = (
+        select(deleted_image.c.cat_id, deleted_image.c.image_url, CatImageVariantModel.image_url.label("variant_url"))
+        .outerjoin(CatImageVariantModel, CatImageVariantModel.image_id == deleted_image.c.id)
+    )
+    rows = (await session.execute(query)).all()
+    if not rows:
+        return SuccessScheme()
+    # Оригинал и его копии общие для всех картинок с тем же содержимым: удаляются после последней ссылки
+    unused = await release_objects(session, [rows[0].image_url])
+    await touch_cat(session, rows[0].cat_id)
     await session.commit()
+    s3_reaper.enqueue_released({image_url: [row.variant_url for row in rows if row.variant_url is not None]
+                                for image_url in unused})
+    await cat_cache.invalidate(rows[0].cat_id)
     return SuccessScheme()
@@ -4,16 +4,24 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from src.database.db_session import AsyncPostgresClient
-from src.api import main_router
+from src.api import main_router, local_stats
+from src.api.admission import AdmissionMiddleware
+from src.cache.cat_cache import cat_cache
 from src.message_broker.broker_service import broker_service
+from src.message_broker.outbox_relay import outbox_relay
+from src.metrics.middleware import MetricsMiddleware
+from src.metrics.multiprocess import worker_snapshots
+from src.s3.reaper import s3_reaper
 from src.s3.s3_service import S3Service
 from src.settings import settings
 
 
 class App(FastAPI):
     def __init__(self):
-        super().__init__(lifespan=App.lifespan, debug=True)
+        super().__init__(lifespan=App.lifespan, debug=settings.debug)
         super().include_router(main_router)
+        # Последний добавленный - внешний: метрики видят и отклоненные запросы, а 503 получает CORS-заголовки
+        super().add_middleware(AdmissionMiddleware)
         super().add_middleware(
             CORSMiddleware,
             allow_origins=["*"],
@@ -21,20 +29,37 @@ class App(FastAPI):
             allow_methods=["*"],
             allow_headers=["*"],
         )
+        super().add_middleware(MetricsMiddleware)
 
     @staticmethod
     @asynccontextmanager
     async def lifespan(_app: FastAPI):
-        await AsyncPostgresClient.init_postgres(settings.postgres_url)
+        await AsyncPostgresClient.init_postgres(settings.postgres_url,
+                                                replica_urls=settings.postgres_replica_urls,
+                                                replica_retry_after=settings.postgres_replica_retry_after,
+                                                **settings.postgres_engine_options)
         await S3Service.init_s3(bucket_name=settings.s3_bucket, endpoint_url=settings.s3_url,
                                 access_key=settings.s3_access_key, secret_key=settings.s3_secret_key,
-                                external_url=settings.s3_external_url)
+                                external_url=settings.s3_external_url,
+                                max_pool_connections=settings.s3_max_pool_connections,
+                                connect_timeout=settings.s3_connect_timeout,
+                                read_timeout=settings.s3_read_timeout,
+                                keepalive_timeout=settings.s3_keepalive_timeout)
+        await s3_reaper.start()
         await broker_service.connect()
+        await outbox_relay.start()
+        await cat_cache.start()
+        await worker_snapshots.start(local_stats)
         logging.info("All resources have been successfully initialized")
 
         yield
 
+        await worker_snapshots.stop()
+        await outbox_relay.stop()
+        # Последняя пачка reaper проверяет счетчики в Postgres и удаляет объекты в S3
+        await s3_reaper.stop()
         await AsyncPostgresClient.close_postgres()
         await S3Service.close_s3()
         await broker_service.disconnect()
+        await cat_cache.stop()
         logging.info("All resources have been successfully closed")
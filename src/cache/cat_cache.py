@@ -0,0 +1,124 @@
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple, Set, Callable, Awaitable, NamedTuple
+
+import aio_pika
+
+from src.cache.single_flight import SingleFlight
+from src.message_broker.broker_service import RabbitMQService
+from src.settings import settings
+
+
+class CachedCat(NamedTuple):
+    """Сериализованный CatFullScheme и версия строки кота, из которой он построен"""
+    body: bytes
+    version: int
+    updated_at: datetime
+
+
+class CatCache:
+    """
+    LRU/TTL-кэш сериализованных CatFullScheme с рассылкой инвалидаций между воркерами.
+    Для одного кота хранится по записи на каждый запрошенный размер картинок.
+    """
+
+    def __init__(self, broker: RabbitMQService, max_size: int, ttl: float):
+        self.broker = broker
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[int, Optional[int]], Tuple[float, CachedCat]] = OrderedDict()
+        self._sizes: Dict[int, Set[Optional[int]]] = {}
+        self._origin = uuid.uuid4().hex
+        self.loads = SingleFlight("cat")
+
+    def get(self, cat_id: int, image_size: Optional[int] = None) -> Optional[CachedCat]:
+        """Возвращает закэшированный ответ или None, если его нет или он устарел"""
+        key = (cat_id, image_size)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, cat_id: int, payload: CachedCat, image_size: Optional[int] = None) -> None:
+        key = (cat_id, image_size)
+        self._entries[key] = (time.monotonic() + self.ttl, payload)
+        self._entries.move_to_end(key)
+        self._sizes.setdefault(cat_id, set()).add(image_size)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    async def load(self, cat_id: int, image_size: Optional[int],
+                   loader: Callable[[], Awaitable[Optional[CachedCat]]],
+                   use_primary: bool = False) -> Optional[CachedCat]:
+        """
+        Загрузка после промаха get через loader, одна на все одновременные запросы того же кота.
+        Загрузка, начатая до инвалидации, отдает результат своим ожидающим, но в кэш его не кладет.
+        """
+        key = (cat_id, image_size, use_primary)
+
+        async def load() -> Optional[CachedCat]:
+            loaded = await loader()
+            if loaded is not None and self.loads.owns(key):
+                self.set(cat_id, loaded, image_size)
+            return loaded
+
+        return await self.loads.do(key, load)
+
+    def _remove(self, key: Tuple[int, Optional[int]]) -> None:
+        del self._entries[key]
+        sizes = self._sizes[key[0]]
+        sizes.discard(key[1])
+        if not sizes:
+            del self._sizes[key[0]]
+
+    def discard(self, cat_id: int) -> None:
+        """Удаление всех записей кота только в текущем процессе"""
+        for image_size in self._sizes.pop(cat_id, ()):
+            self._entries.pop((cat_id, image_size), None)
+        self.loads.forget(lambda key: key[0] == cat_id)
+
+    async def invalidate(self, cat_id: int) -> None:
+        """Удаление записи локально и во всех остальных воркерах"""
+        self.discard(cat_id)
+        await self.broker.publish_message({"cat_id": cat_id, "origin": self._origin}, persistent=False)
+
+    async def _on_invalidation(self, body: Dict[str, Any], _message: aio_pika.IncomingMessage) -> None:
+        if body.get("origin") != self._origin:
+            self.discard(body["cat_id"])
+
+    async def start(self, listen: bool = True) -> None:
+        """listen=False - процесс только рассылает инвалидации, но не держит кэш и не объявляет очередь"""
+        self.broker.declare_queue = listen
+        await self.broker.connect()
+        if listen:
+            await self.broker.consume_messages(self._on_invalidation)
+
+    async def stop(self) -> None:
+        await self.broker.disconnect()
+        self._entries.clear()
+        self._sizes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "loads": self.loads.stats()}
+
+
+cat_cache = CatCache(
+    broker=RabbitMQService(
+        url=settings.broker_url,
+        queue_name="",
+        exchange_name=settings.cat_cache_exchange,
+        exchange_type="fanout",
+        exclusive=True
+    ),
+    max_size=settings.cat_cache_size,
+    ttl=settings.cat_cache_ttl
+)
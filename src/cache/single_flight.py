@@ -0,0 +1,66 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from src.metrics.registry import single_flight_calls_total
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных загрузок в одном процессе: первый вызов с ключом запускает
+    loader в отдельной задаче, остальные ждут ее же результат или исключение. Отмена одного ожидающего
+    не прерывает загрузку для остальных; задача отменяется, только когда ждать ее больше некому.
+    Результат получают все ожидающие, поэтому он должен быть неизменяемым (например, bytes).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(loader()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._finish(key, call))
+            self.executed += 1
+            single_flight_calls_total.inc(self.name, "executed")
+        else:
+            self.coalesced += 1
+            single_flight_calls_total.inc(self.name, "coalesced")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Отменяемая задача завершится не сразу: новый вызов не должен к ней присоединиться
+                self._finish(key, call)
+                call.task.cancel()
+
+    def _finish(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def owns(self, key: Hashable) -> bool:
+        """Текущая задача - действующая загрузка для key (ее не вытеснил forget)"""
+        call = self._calls.get(key)
+        return call is not None and call.task is asyncio.current_task()
+
+    def forget(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Новые вызовы с подходящими ключами не присоединятся к уже идущим загрузкам"""
+        for key in [key for key in self._calls if predicate(key)]:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
@@ -1,4 +1,9 @@
+from datetime import datetime
 from typing import Annotated
+from sqlalchemy import text
 from sqlalchemy.orm import mapped_column
 
 intpk = Annotated[int, mapped_column(primary_key=True, autoincrement=True)]
+created_at = Annotated[datetime, mapped_column(server_default=text("TIMEZONE('utc', now())"))]
+updated_at = Annotated[datetime, mapped_column(server_default=text("TIMEZONE('utc', now())"))]
+version = Annotated[int, mapped_column(server_default=text("1"))]
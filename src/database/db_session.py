@@ -1,41 +1,167 @@
 import logging
-from typing import Optional
+import time
+from typing import Optional, Dict, Any, List, Sequence
+from fastapi import Request, Response
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
-from src.database.base import Base
+from src.database.migrations import check_schema_version
+from src.database.metrics import EngineMetrics, TimedAsyncQueuePool
+from src.settings import settings
+
+LAST_WRITE_COOKIE = "last_write_at"
 
 
 class AsyncPostgresClient:
     _engine: Optional[AsyncEngine] = None
     _async_session_maker: Optional[async_sessionmaker] = None
+    _metrics: Optional[EngineMetrics] = None
+    _replica_engines: List[AsyncEngine] = []
+    _replica_session_makers: List[async_sessionmaker] = []
+    _replica_metrics: List[EngineMetrics] = []
+    _replica_retry_after: float = 10.0
+    _next_replica: int = 0
+
+    @staticmethod
+    def _create_engine(
+            db_url: str,
+            pool_size: int,
+            max_overflow: int,
+            pool_timeout: float,
+            pool_recycle: int,
+            pool_pre_ping: bool,
+            statement_cache_size: int,
+            echo: bool,
+    ) -> AsyncEngine:
+        return create_async_engine(
+            db_url,
+            poolclass=TimedAsyncQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            echo=echo,
+            connect_args={"prepared_statement_cache_size": statement_cache_size},
+        )
 
     @classmethod
-    async def init_postgres(cls, db_url: str) -> None:
+    async def init_postgres(
+            cls,
+            db_url: str,
+            replica_urls: Sequence[str] = (),
+            replica_retry_after: float = 10.0,
+            pool_size: int = 10,
+            max_overflow: int = 10,
+            pool_timeout: float = 30.0,
+            pool_recycle: int = 1800,
+            pool_pre_ping: bool = True,
+            statement_cache_size: int = 100,
+            echo: bool = False,
+    ) -> None:
         if cls._async_session_maker is not None:
             logging.info("Postgres is already initialized")
             return
 
-        cls._engine = create_async_engine(db_url, max_overflow=1100, pool_size=1000, echo=True)
+        engine_options = {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": pool_timeout,
+            "pool_recycle": pool_recycle,
+            "pool_pre_ping": pool_pre_ping,
+            "statement_cache_size": statement_cache_size,
+            "echo": echo,
+        }
+        cls._engine = cls._create_engine(db_url, **engine_options)
+        cls._metrics = EngineMetrics(cls._engine)
         cls._async_session_maker = async_sessionmaker(bind=cls._engine, expire_on_commit=False)
 
-        async with cls._engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        cls._replica_engines = [cls._create_engine(url, **engine_options) for url in replica_urls]
+        cls._replica_metrics = [EngineMetrics(engine, name=f"replica-{idx}")
+                                for idx, engine in enumerate(cls._replica_engines)]
+        cls._replica_session_makers = [async_sessionmaker(bind=engine, expire_on_commit=False)
+                                       for engine in cls._replica_engines]
+        cls._replica_retry_after = replica_retry_after
+        cls._next_replica = 0
 
-        logging.info("Postgres initialized")
+        # Схема создается миграциями (python -m src.migrate) до запуска воркеров, здесь только проверка версии
+        async with cls._engine.connect() as conn:
+            await check_schema_version(conn)
+
+        logging.info(f"Postgres initialized with {len(cls._replica_engines)} replicas")
 
     @classmethod
     async def close_postgres(cls) -> None:
         if cls._engine is not None:
             logging.info("Postgres closed")
             await cls._engine.dispose()
+            for engine in cls._replica_engines:
+                await engine.dispose()
             cls._engine = None
             cls._async_session_maker = None
+            cls._metrics = None
+            cls._replica_engines = []
+            cls._replica_session_makers = []
+            cls._replica_metrics = []
 
     @classmethod
     def get_async_session(cls) -> async_sessionmaker:
         return cls._async_session_maker
 
+    @classmethod
+    def get_read_session(cls, use_primary: bool = False) -> async_sessionmaker:
+        """
+        Фабрика сессий только для чтения: реплики по кругу, пропуская те,
+        с которыми недавно терялось соединение. Если реплик нет - основная база.
+        """
+        replicas_count = len(cls._replica_session_makers)
+        if use_primary or not replicas_count:
+            return cls._async_session_maker
+        for _ in range(replicas_count):
+            idx = cls._next_replica
+            cls._next_replica = (idx + 1) % replicas_count
+            if cls._replica_metrics[idx].is_healthy(cls._replica_retry_after):
+                return cls._replica_session_makers[idx]
+        return cls._async_session_maker
+
+    @classmethod
+    def is_saturated(cls, read: bool = False) -> bool:
+        """Для чтения - заняты пулы всех реплик (или основной, если реплик нет), для записи - пул основной базы"""
+        if cls._metrics is None:
+            return False
+        if read and cls._replica_metrics:
+            return all(metrics.is_saturated() for metrics in cls._replica_metrics)
+        return cls._metrics.is_saturated()
 
-async def create_session() -> AsyncSession:
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        if cls._metrics is None:
+            return {}
+        return {
+            "primary": cls._metrics.snapshot(),
+            "replicas": [metrics.snapshot() for metrics in cls._replica_metrics],
+        }
+
+
+def recently_wrote(request: Request) -> bool:
+    """Клиент писал в базу в последние read_your_writes_seconds секунд"""
+    try:
+        last_write_at = float(request.cookies.get(LAST_WRITE_COOKIE, ""))
+    except ValueError:
+        return False
+    return time.time() - last_write_at < settings.read_your_writes_seconds
+
+
+async def create_session(response: Response) -> AsyncSession:
+    # Сессия основной базы используется только для записи: помечаем клиента,
+    # чтобы его ближайшие чтения тоже шли в основную базу (read-your-writes)
+    if settings.read_your_writes_seconds > 0:
+        response.set_cookie(LAST_WRITE_COOKIE, str(time.time()), max_age=int(settings.read_your_writes_seconds) + 1,
+                            httponly=True)
     async_session_maker = AsyncPostgresClient.get_async_session()
     async with async_session_maker() as session:
         yield session  # yield для закрытия сессии
+
+
+async def create_read_session(request: Request) -> AsyncSession:
+    async_session_maker = AsyncPostgresClient.get_read_session(use_primary=recently_wrote(request))
+    async with async_session_maker() as session:
+        yield session
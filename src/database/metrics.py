@@ -0,0 +1,90 @@
+import time
+from typing import Dict, Any, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.metrics.registry import db_statement_duration
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, замеряющий время ожидания свободного соединения"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquires = 0
+        self.acquire_seconds = 0.0
+        self.acquire_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.acquires += 1
+            self.acquire_seconds += elapsed
+            self.acquire_max = max(self.acquire_max, elapsed)
+
+
+class EngineMetrics:
+    """Счетчики выполнения запросов и состояния пула одного движка"""
+
+    def __init__(self, engine: AsyncEngine, name: str = "primary"):
+        self.engine = engine
+        self.name = name
+        self.statements = 0
+        self.errors = 0
+        self.statement_seconds = 0.0
+        self.statement_max = 0.0
+        self.last_disconnect_at: Optional[float] = None
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_execute)
+        event.listen(sync_engine, "handle_error", self._on_error)
+
+    def _before_execute(self, _conn, _cursor, _statement, _parameters, context, _executemany) -> None:
+        context.metrics_started = time.perf_counter()
+
+    def _after_execute(self, _conn, _cursor, _statement, _parameters, context, _executemany) -> None:
+        elapsed = time.perf_counter() - context.metrics_started
+        self.statements += 1
+        self.statement_seconds += elapsed
+        self.statement_max = max(self.statement_max, elapsed)
+        db_statement_duration.observe(elapsed, self.name)
+
+    def _on_error(self, exception_context) -> None:
+        self.errors += 1
+        # connection is None - не удалось даже установить соединение
+        if exception_context.is_disconnect or exception_context.connection is None:
+            self.last_disconnect_at = time.monotonic()
+
+    def is_healthy(self, retry_after: float) -> bool:
+        """False, если соединение с базой терялось меньше retry_after секунд назад"""
+        return self.last_disconnect_at is None or time.monotonic() - self.last_disconnect_at >= retry_after
+
+    def is_saturated(self) -> bool:
+        """Все соединения пула, включая overflow, заняты: следующий запрос встанет в очередь"""
+        pool = self.engine.sync_engine.pool
+        return pool.checkedin() == 0 and pool.overflow() >= pool._max_overflow
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.engine.sync_engine.pool
+        stats: Dict[str, Any] = {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "statements": self.statements,
+            "statement_errors": self.errors,
+            "statement_avg_ms": round(self.statement_seconds / self.statements * 1000, 3) if self.statements else 0.0,
+            "statement_max_ms": round(self.statement_max * 1000, 3),
+        }
+        if isinstance(pool, TimedAsyncQueuePool):
+            stats.update({
+                "acquires": pool.acquires,
+                "acquire_avg_ms": round(pool.acquire_seconds / pool.acquires * 1000, 3) if pool.acquires else 0.0,
+                "acquire_max_ms": round(pool.acquire_max * 1000, 3),
+            })
+        return stats
@@ -0,0 +1,151 @@
+import logging
+from dataclasses import dataclass
+from typing import Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection
+from sqlalchemy.pool import NullPool
+
+# Ключ advisory-блокировки: миграции от нескольких процессов выполняются по очереди
+MIGRATIONS_LOCK_KEY = 7_301_845_001
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "Начальная схема", (
+        """
+        CREATE TABLE IF NOT EXISTS cats (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            birthday DATE NOT NULL,
+            color VARCHAR NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cats_images (
+            id SERIAL PRIMARY KEY,
+            cat_id INTEGER NOT NULL,
+            image_url VARCHAR NOT NULL
+        )
+        """,
+        # Базы, созданные через create_all, получили внешний ключ без каскадного удаления
+        "ALTER TABLE cats_images DROP CONSTRAINT IF EXISTS cats_images_cat_id_fkey",
+        """
+        ALTER TABLE cats_images ADD CONSTRAINT cats_images_cat_id_fkey
+            FOREIGN KEY (cat_id) REFERENCES cats (id) ON DELETE CASCADE
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cats_images_variants (
+            id SERIAL PRIMARY KEY,
+            image_id INTEGER NOT NULL REFERENCES cats_images (id) ON DELETE CASCADE,
+            width INTEGER NOT NULL,
+            image_url VARCHAR NOT NULL,
+            UNIQUE (image_id, width)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id SERIAL PRIMARY KEY,
+            routing_key VARCHAR,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT TIMEZONE('utc', now()) NOT NULL
+        )
+        """,
+    )),
+    Migration(2, "Индексы для выборок по коту, цвету, дате рождения и поиска по имени", (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_cats_images_cat_id ON cats_images (cat_id)",
+        "CREATE INDEX IF NOT EXISTS ix_cats_color ON cats (color)",
+        "CREATE INDEX IF NOT EXISTS ix_cats_birthday ON cats (birthday)",
+        "CREATE INDEX IF NOT EXISTS ix_cats_name_trgm ON cats USING gin (name gin_trgm_ops)",
+    )),
+    Migration(3, "Счетчики ссылок на объекты S3 с оригиналами картинок", (
+        """
+        CREATE TABLE IF NOT EXISTS cats_images_objects (
+            image_url VARCHAR PRIMARY KEY,
+            refcount INTEGER NOT NULL CHECK (refcount >= 0),
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT TIMEZONE('utc', now()) NOT NULL
+        )
+        """,
+        # Картинки, загруженные до адресации по содержимому, лежат под случайными ключами - по ссылке на каждую
+        """
+        INSERT INTO cats_images_objects (image_url, refcount)
+        SELECT image_url, count(*) FROM cats_images GROUP BY image_url
+        ON CONFLICT (image_url) DO NOTHING
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_cats_images_image_url ON cats_images (image_url)",
+    )),
+    Migration(4, "Версии строк котов и картинок для условных GET", (
+        "ALTER TABLE cats ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+        """
+        ALTER TABLE cats ADD COLUMN IF NOT EXISTS updated_at
+            TIMESTAMP WITHOUT TIME ZONE DEFAULT TIMEZONE('utc', now()) NOT NULL
+        """,
+        "ALTER TABLE cats_images ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+        """
+        ALTER TABLE cats_images ADD COLUMN IF NOT EXISTS updated_at
+            TIMESTAMP WITHOUT TIME ZONE DEFAULT TIMEZONE('utc', now()) NOT NULL
+        """,
+    )),
+    Migration(5, "Поиск объектов без ссылок, ожидающих удаления из S3", (
+        "CREATE INDEX IF NOT EXISTS ix_cats_images_objects_unused ON cats_images_objects (image_url) "
+        "WHERE refcount = 0",
+    )),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def get_schema_version(conn: AsyncConnection) -> int:
+    exists = await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL"))
+    if not exists:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+
+async def check_schema_version(conn: AsyncConnection) -> None:
+    version = await get_schema_version(conn)
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version is {version}, expected {SCHEMA_VERSION}. "
+                           f"Run `python -m src.migrate` first")
+
+
+async def run_migrations(db_url: str) -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает итоговую версию схемы"""
+    engine = create_async_engine(db_url, poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            await conn.commit()
+            try:
+                await conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS schema_version ("
+                    "version INTEGER PRIMARY KEY, "
+                    "description VARCHAR NOT NULL, "
+                    "applied_at TIMESTAMP WITHOUT TIME ZONE DEFAULT TIMEZONE('utc', now()) NOT NULL)"
+                ))
+                current = await get_schema_version(conn)
+                await conn.commit()
+                for migration in MIGRATIONS:
+                    if migration.version <= current:
+                        continue
+                    for statement in migration.statements:
+                        await conn.execute(text(statement))
+                    await conn.execute(text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                                       {"v": migration.version, "d": migration.description})
+                    await conn.commit()
+                    logging.info(f"Applied migration {migration.version}: {migration.description}")
+            finally:
+                await conn.rollback()
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+                await conn.commit()
+    finally:
+        await engine.dispose()
+    logging.info(f"Database schema is at version {SCHEMA_VERSION}")
+    return SCHEMA_VERSION
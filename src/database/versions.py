@@ -0,0 +1,16 @@
+from typing import Any, Dict
+
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models import CatModel
+
+
+def bumped(model) -> Dict[str, Any]:
+    """Значения для UPDATE, которые увеличивают версию строки и обновляют updated_at"""
+    return {"version": model.version + 1, "updated_at": func.timezone("utc", func.now())}
+
+
+async def touch_cat(session: AsyncSession, cat_id: int) -> None:
+    """Новая версия кота в текущей транзакции: от картинок зависит его представление, а значит и ETag"""
+    await session.execute(update(CatModel).filter(CatModel.id == cat_id).values(**bumped(CatModel)))
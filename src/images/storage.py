@@ -0,0 +1,130 @@
+import hashlib
+import uuid
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import update, values, column, String, Integer
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models import CatImageObjectModel
+from src.s3.reaper import s3_reaper
+from src.s3.s3_service import S3Service
+
+IMAGE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/svg+xml": ".svg", "image/gif": ".gif"}
+# Ключ объекта однозначно определяется содержимым (или выдан сервером один раз), поэтому объект не меняется
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Формат изображения по первым байтам, а не по заявленному клиентом типу"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    text_head = head[:1024].lstrip(b"\xef\xbb\xbf \t\r\n")
+    if text_head.startswith(b"<") and b"<svg" in text_head:
+        return "image/svg+xml"
+    return None
+
+
+class _HashingStream:
+    """Поток с асинхронным read(n), который считает sha256 и размер прочитанного"""
+
+    def __init__(self, stream, first: bytes, max_size: int):
+        self._stream = stream
+        self._pending = first
+        self._max_size = max_size
+        self.digest = hashlib.sha256(first)
+        self.size = len(first)
+
+    async def read(self, size: int) -> bytes:
+        if self._pending:
+            chunk, self._pending = self._pending, b""
+            return chunk
+        chunk = await self._stream.read(size)
+        self.size += len(chunk)
+        if self.size > self._max_size:
+            raise ImageTooLargeError(self.size)
+        self.digest.update(chunk)
+        return chunk
+
+
+async def acquire_object(session: AsyncSession, image_url: str) -> bool:
+    """
+    Добавляет ссылку на объект в текущей транзакции; True, если ссылка первая - в том числе
+    для строки с нулевым счетчиком, объект которой мог уже удалить reaper: такой объект загружается заново.
+    Строка счетчика остается заблокированной до коммита, поэтому reaper не удалит ожившую запись.
+    """
+    query = (
+        insert(CatImageObjectModel)
+        .values(image_url=image_url, refcount=1)
+        .on_conflict_do_update(index_elements=[CatImageObjectModel.image_url],
+                               set_={"refcount": CatImageObjectModel.refcount + 1})
+        .returning(CatImageObjectModel.refcount)
+    )
+    return await session.scalar(query) == 1
+
+
+async def release_objects(session: AsyncSession, image_urls: Iterable[str]) -> List[str]:
+    """
+    Убирает по ссылке на каждый url; возвращает url объектов, на которые больше никто не ссылается.
+    Строки с нулевым счетчиком остаются до удаления объектов: их после коммита передают s3_reaper
+    """
+    counts = Counter(image_urls)
+    if not counts:
+        return []
+    released = values(column("image_url", String), column("n", Integer), name="released").data(
+        sorted(counts.items()))
+    query = (
+        update(CatImageObjectModel)
+        .filter(CatImageObjectModel.image_url == released.c.image_url)
+        .values(refcount=CatImageObjectModel.refcount - released.c.n)
+        .returning(CatImageObjectModel.image_url, CatImageObjectModel.refcount)
+    )
+    rows = (await session.execute(query)).all()
+    return [row.image_url for row in rows if row.refcount <= 0]
+
+
+async def store_image(session: AsyncSession, stream, part_size: int, concurrency: int, max_size: int) -> Dict[str, str]:
+    """
+    Сохраняет картинку под ключом sha256 содержимого с расширением по ее настоящему формату.
+    Если на такой объект уже есть ссылки, повторно он не загружается, а только получает еще одну.
+    Маленькие файлы хэшируются в памяти до загрузки; большие уходят multipart-загрузкой
+    во временный ключ и копируются под итоговый внутри S3. Транзакцию коммитит вызывающий.
+    Возвращает object_name, image_url и content_type.
+    """
+    first = await stream.read(part_size)
+    content_type = sniff_content_type(first)
+    if content_type is None:
+        raise ValueError("Unsupported image format")
+    if len(first) > max_size:
+        raise ImageTooLargeError(len(first))
+
+    if len(first) < part_size:
+        object_name = f"{hashlib.sha256(first).hexdigest()}{IMAGE_EXTENSIONS[content_type]}"
+        url = S3Service.object_url(object_name)
+        if await acquire_object(session, url):
+            await S3Service.upload_file_object(object_name, first, content_type=content_type,
+                                               cache_control=IMMUTABLE_CACHE_CONTROL)
+        return {"object_name": object_name, "image_url": url, "content_type": content_type}
+
+    hashing_stream = _HashingStream(stream, first, max_size)
+    temp_name = f"tmp/{uuid.uuid4()}"
+    await S3Service.upload_stream(temp_name, hashing_stream, content_type=content_type,
+                                  part_size=part_size, concurrency=concurrency)
+    try:
+        object_name = f"{hashing_stream.digest.hexdigest()}{IMAGE_EXTENSIONS[content_type]}"
+        url = S3Service.object_url(object_name)
+        if await acquire_object(session, url):
+            await S3Service.copy_file_object(temp_name, object_name, content_type=content_type,
+                                             cache_control=IMMUTABLE_CACHE_CONTROL)
+    finally:
+        s3_reaper.enqueue([temp_name])
+    return {"object_name": object_name, "image_url": url, "content_type": content_type}
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Dict, Any, List
+
+import aio_pika
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from src.cache.cat_cache import cat_cache
+from src.database.db_session import AsyncPostgresClient
+from src.database.versions import bumped, touch_cat
+from src.images.storage import IMMUTABLE_CACHE_CONTROL
+from src.images.thumbnails import make_variants, variant_object_name, RESIZABLE_CONTENT_TYPES, VARIANT_CONTENT_TYPE
+from src.models import CatImageModel, CatImageVariantModel, CatImageObjectModel
+from src.s3.s3_service import S3Service
+from src.settings import settings
+
+
+class ThumbnailHandler:
+    """Обработчик события image_uploaded: строит уменьшенные копии и сохраняет их в S3 и БД"""
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+
+    async def __call__(self, body: Dict[str, Any], _message: aio_pika.IncomingMessage) -> None:
+        if body.get("event") != "image_uploaded" or body["content_type"] not in RESIZABLE_CONTENT_TYPES:
+            return
+
+        rows = await self._existing_variants(body)
+        if rows:
+            # То же содержимое уже загружали: копии в S3 общие, нужны только строки для новой картинки
+            await self._save_variants(body, rows)
+            return
+
+        data = await S3Service.get_file_object(body["object_name"])
+        if data is None:
+            logging.warning(f"Image {body['object_name']} disappeared before thumbnails were made")
+            return
+
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(self.executor, make_variants, data, settings.thumbnail_sizes)
+        if not variants:
+            return
+
+        rows: List[Dict[str, Any]] = []
+        for width, content in variants:
+            object_name = variant_object_name(body["object_name"], width)
+            url = await S3Service.upload_file_object(object_name, content, content_type=VARIANT_CONTENT_TYPE,
+                                                     cache_control=IMMUTABLE_CACHE_CONTROL)
+            rows.append({"image_id": body["image_id"], "width": width, "image_url": url})
+        await self._save_variants(body, rows)
+
+    @staticmethod
+    async def _existing_variants(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        image_url = S3Service.object_url(body["object_name"])
+        query = (
+            select(CatImageVariantModel.width, CatImageVariantModel.image_url)
+            .join(CatImageModel, CatImageModel.id == CatImageVariantModel.image_id)
+            .filter(CatImageModel.image_url == image_url, CatImageModel.id != body["image_id"])
+            .distinct()
+        )
+        async_session_maker = AsyncPostgresClient.get_read_session()
+        async with async_session_maker() as session:
+            res = await session.execute(query)
+            return [{"image_id": body["image_id"], "width": row.width, "image_url": row.image_url} for row in res]
+
+    @staticmethod
+    async def _save_variants(body: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+        async_session_maker = AsyncPostgresClient.get_async_session()
+        async with async_session_maker() as session:
+            try:
+                await session.execute(insert(CatImageVariantModel).values(rows).on_conflict_do_nothing())
+                # Копии меняют ответ GET /cats/{cat_id}?image_size=..., поэтому меняются и версии (ETag)
+                await session.execute(update(CatImageModel).filter(CatImageModel.id == body["image_id"])
+                                      .values(**bumped(CatImageModel)))
+                await touch_cat(session, body["cat_id"])
+                await session.commit()
+            except IntegrityError:
+                # Картинку успели удалить, пока строились уменьшенные копии. Копии общие для одинакового
+                # содержимого, поэтому удаляются, только если строки оригинала уже нет; строку с нулевым
+                # счетчиком дочищает s3_reaper API вместе со всеми копиями
+                logging.info(f"Image {body['image_id']} was deleted, dropping its thumbnails")
+                await session.rollback()
+                image_url = S3Service.object_url(body["object_name"])
+                if await session.get(CatImageObjectModel, image_url) is None:
+                    await S3Service.delete_file_objects([S3Service.object_name_from_url(row["image_url"])
+                                                         for row in rows])
+                return
+
+        await cat_cache.invalidate(body["cat_id"])
+        logging.info(f"Thumbnails {[row['width'] for row in rows]} created for image {body['image_id']}")
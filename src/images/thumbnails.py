@@ -0,0 +1,38 @@
+import io
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+VARIANT_CONTENT_TYPE = "image/webp"
+RESIZABLE_CONTENT_TYPES = ("image/png", "image/jpeg", "image/gif")
+
+
+def make_variants(data: bytes, sizes: Sequence[int]) -> List[Tuple[int, bytes]]:
+    """
+    Уменьшенные копии изображения в WebP для каждой ширины из sizes, которая меньше исходной.
+    Выполняется в отдельном процессе, поэтому работает только с байтами.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        original.seek(0)
+        image = original.convert("RGBA" if original.mode in ("RGBA", "LA", "P") else "RGB")
+
+    variants = []
+    for width in sorted(set(sizes)):
+        if width >= image.width:
+            break
+        height = max(1, round(image.height * width / image.width))
+        buffer = io.BytesIO()
+        image.resize((width, height), Image.Resampling.LANCZOS).save(buffer, format="WEBP", quality=80)
+        variants.append((width, buffer.getvalue()))
+    return variants
+
+
+def fitting_size(requested: Optional[int], sizes: Sequence[int]) -> Optional[int]:
+    """Наименьший из доступных размеров, не меньший запрошенного; None - нужен оригинал"""
+    if requested is None:
+        return None
+    return min((size for size in sizes if size >= requested), default=None)
+
+
+def variant_object_name(object_name: str, width: int) -> str:
+    return f"{object_name.rsplit('.', 1)[0]}_w{width}.webp"
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Set, Callable, Awaitable
+
+import aio_pika
+
+from src.message_broker.broker_service import RabbitMQService, ATTEMPT_HEADER
+
+MessageHandler = Callable[[Dict[str, Any], aio_pika.IncomingMessage], Awaitable[None]]
+BatchHandler = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+@dataclass
+class HandlerStats:
+    processed: int = 0
+    failed: int = 0
+    calls: int = 0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def observe(self, seconds: float, count: int = 1, failed: bool = False) -> None:
+        self.calls += 1
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        if failed:
+            self.failed += count
+        else:
+            self.processed += count
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "calls": self.calls,
+            "throughput_per_second": round((self.processed + self.failed) / elapsed, 2),
+            "latency_avg_ms": round(self.latency_total / self.calls * 1000, 2) if self.calls else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 2),
+        }
+
+
+class ConsumerWorker:
+    """
+    Рабочий цикл потребителя очереди.
+
+    С handler сообщения обрабатываются параллельно (не больше concurrency одновременно)
+    и подтверждаются по одному. С batch_handler сообщения копятся до batch_size штук
+    или batch_timeout_ms миллисекунд и подтверждаются одним ack(multiple=True);
+    пачки обрабатываются строго по очереди, иначе multiple-ack задел бы чужие сообщения.
+
+    Сообщение, на котором упал обработчик, после паузы retry_delay * номер попытки публикуется
+    в очередь повторно, пока не наберется max_attempts попыток; пауза держит слот обработки,
+    поэтому при отказе S3 или БД поток сообщений замедляется, а не сжигает попытки.
+    """
+
+    def __init__(
+            self,
+            broker: RabbitMQService,
+            handler: Optional[MessageHandler] = None,
+            batch_handler: Optional[BatchHandler] = None,
+            concurrency: int = 10,
+            batch_size: int = 100,
+            batch_timeout_ms: int = 200,
+            stats_interval: Optional[float] = None,
+            max_attempts: int = 5,
+            retry_delay: float = 1.0,
+    ):
+        if (handler is None) == (batch_handler is None):
+            raise ValueError("Exactly one of handler and batch_handler must be set")
+        self.broker = broker
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout_ms / 1000
+        self.stats_interval = stats_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = HandlerStats()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._batch: List[aio_pika.IncomingMessage] = []
+        self._batch_lock = asyncio.Lock()
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._consumer_tag: Optional[str] = None
+        self._reporter: Optional[asyncio.Task] = None
+
+    @property
+    def name(self) -> str:
+        handler = self.handler or self.batch_handler
+        return getattr(handler, "__name__", type(handler).__name__)
+
+    async def start(self) -> None:
+        self._consumer_tag = await self.broker.consume_raw(self._on_message)
+        if self.stats_interval:
+            self._reporter = asyncio.create_task(self._report_stats())
+        logging.info(f"Consumer worker {self.name} started")
+
+    async def drain(self) -> None:
+        """Прекращает получение новых сообщений и дожидается обработки уже полученных"""
+        if self._consumer_tag is not None:
+            await self.broker.cancel_consuming(self._consumer_tag)
+            self._consumer_tag = None
+        while self.batch_handler is not None and self._batch:
+            await self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._reporter is not None:
+            self._reporter.cancel()
+            self._reporter = None
+        logging.info(f"Consumer worker {self.name} drained: {self.stats.as_dict()}")
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _on_message(self, message: aio_pika.IncomingMessage) -> None:
+        if self.batch_handler is None:
+            await self._slots.acquire()
+            self._spawn(self._process(message))
+            return
+
+        self._batch.append(message)
+        # Сообщения, пришедшие во время обработки пачки, не порождают лишних flush: хватит одного на пачку
+        if len(self._batch) == self.batch_size:
+            self._spawn(self._flush())
+        else:
+            self._arm_timer()
+
+    def _arm_timer(self) -> None:
+        if self._batch and self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(
+                self.batch_timeout, lambda: self._spawn(self._flush())
+            )
+
+    async def _retry_pause(self, message: aio_pika.IncomingMessage) -> None:
+        attempt = int((message.headers or {}).get(ATTEMPT_HEADER, 1))
+        if attempt < self.max_attempts:
+            await asyncio.sleep(self.retry_delay * attempt)
+
+    async def _process(self, message: aio_pika.IncomingMessage) -> None:
+        started = time.perf_counter()
+        try:
+            try:
+                body = json.loads(message.body.decode())
+            except ValueError as e:
+                logging.error(f"Skipping malformed message: {e}")
+                self.stats.observe(time.perf_counter() - started, failed=True)
+                await message.nack(requeue=False)
+                return
+            try:
+                await self.handler(body, message)
+            except Exception as e:
+                logging.error(f"Error processing message: {e}")
+                self.stats.observe(time.perf_counter() - started, failed=True)
+                await self._retry_pause(message)
+                await self.broker.reject(message, self.max_attempts)
+            else:
+                self.stats.observe(time.perf_counter() - started)
+                await message.ack()
+        finally:
+            self._slots.release()
+
+    async def _flush(self) -> None:
+        async with self._batch_lock:
+            if self._batch_timer is not None:
+                self._batch_timer.cancel()
+                self._batch_timer = None
+            messages = self._batch[:self.batch_size]
+            del self._batch[:len(messages)]
+            try:
+                await self._process_batch(messages)
+            finally:
+                # Остаток, накопленный за время обработки, уходит следующей пачкой
+                if len(self._batch) >= self.batch_size:
+                    self._spawn(self._flush())
+                else:
+                    self._arm_timer()
+
+    async def _process_batch(self, messages: List[aio_pika.IncomingMessage]) -> None:
+        if not messages:
+            return
+
+        bodies: List[Dict[str, Any]] = []
+        valid: List[aio_pika.IncomingMessage] = []
+        for message in messages:
+            try:
+                bodies.append(json.loads(message.body.decode()))
+                valid.append(message)
+            except ValueError as e:
+                logging.error(f"Skipping malformed message: {e}")
+                await message.nack(requeue=False)
+        if not valid:
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.batch_handler(bodies)
+        except Exception as e:
+            logging.error(f"Error processing batch of {len(valid)} messages: {e}")
+            self.stats.observe(time.perf_counter() - started, count=len(valid), failed=True)
+            await self._retry_pause(valid[0])
+            try:
+                # Копии уходят в конец очереди, после чего вся пачка подтверждается одним ack
+                exhausted = [message for message in valid
+                             if not await self.broker.retry_later(message, self.max_attempts)]
+            except Exception as retry_error:
+                logging.error(f"Failed to schedule retry, requeueing batch: {retry_error}")
+                await valid[-1].nack(multiple=True, requeue=True)
+                return
+            if exhausted:
+                logging.error(f"Dropping {len(exhausted)} messages after {self.max_attempts} attempts")
+            await valid[-1].ack(multiple=True)
+        else:
+            self.stats.observe(time.perf_counter() - started, count=len(valid))
+            await valid[-1].ack(multiple=True)
+
+    async def _report_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logging.info(f"Consumer worker {self.name}: {self.stats.as_dict()}")
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db_session import AsyncPostgresClient
+from src.message_broker.broker_service import RabbitMQService, broker_service
+from src.models import OutboxMessageModel
+from src.settings import settings
+
+
+class OutboxRelay:
+    """Фоновая пересылка сообщений из таблицы outbox в RabbitMQ пачками"""
+
+    def __init__(self, broker: RabbitMQService, batch_size: int = 100, poll_interval: float = 1.0):
+        self.broker = broker
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def add_message(session: AsyncSession, payload: Dict[str, Any], routing_key: Optional[str] = None) -> None:
+        """Добавляет сообщение в текущую транзакцию; отправится после коммита"""
+        session.add(OutboxMessageModel(payload=payload, routing_key=routing_key))
+
+    def notify(self) -> None:
+        """Будит пересылку сразу после коммита, не дожидаясь poll_interval"""
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        logging.info("Outbox relay started")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logging.info("Outbox relay stopped")
+
+    async def relay_batch(self) -> int:
+        """
+        Отправляет одну пачку сообщений и возвращает число доставленных.
+        Строки блокируются через SKIP LOCKED, поэтому пересылку можно запускать в каждом воркере.
+        Публикации в пачке идут параллельно, каждая ждет подтверждения брокера (publisher confirms).
+        """
+        async_session_maker = AsyncPostgresClient.get_async_session()
+        async with async_session_maker() as session:
+            query = (
+                select(OutboxMessageModel)
+                .order_by(OutboxMessageModel.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            messages = (await session.scalars(query)).all()
+            if not messages:
+                return 0
+
+            results = await asyncio.gather(*(
+                self.broker.publish_message(message.payload, routing_key=message.routing_key)
+                for message in messages
+            ))
+            delivered = [message.id for message, ok in zip(messages, results) if ok]
+            if delivered:
+                await session.execute(delete(OutboxMessageModel).filter(OutboxMessageModel.id.in_(delivered)))
+            await session.commit()
+            return len(delivered)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                delivered = await self.relay_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Outbox relay failed: {e}")
+                delivered = 0
+            if delivered < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+
+outbox_relay = OutboxRelay(broker_service, batch_size=settings.outbox_batch_size,
+                           poll_interval=settings.outbox_poll_interval)
@@ -0,0 +1,44 @@
+from typing import Iterable, Tuple
+
+from src.api.admission import admission_budgets
+from src.cache.cat_cache import cat_cache
+from src.database.db_session import AsyncPostgresClient
+from src.metrics.registry import metrics_registry
+from src.s3.s3_service import S3Service
+
+
+def _db_pool() -> Iterable[Tuple[Tuple[str, str], float]]:
+    stats = AsyncPostgresClient.get_stats()
+    engines = [("primary", stats["primary"])] if stats else []
+    engines += [(f"replica-{idx}", replica) for idx, replica in enumerate(stats.get("replicas", []))]
+    for engine, pool in engines:
+        for state in ("checked_out", "checked_in", "overflow"):
+            yield (engine, state), pool[state]
+
+
+def _s3_client() -> Iterable[Tuple[Tuple[str], float]]:
+    stats = S3Service.get_stats()
+    for key in ("in_flight", "max_pool_connections", "pool_waits", "pool_wait_seconds"):
+        if key in stats:
+            yield (key,), stats[key]
+
+
+def _cat_cache() -> Iterable[Tuple[Tuple[str], float]]:
+    for key, value in cat_cache.stats().items():
+        if isinstance(value, (int, float)):  # загрузки считает single_flight_calls_total
+            yield (key,), value
+
+
+def _admission() -> Iterable[Tuple[Tuple[str, str], float]]:
+    for name, budget in admission_budgets.items():
+        for key, value in budget.stats().items():
+            yield (name, key), value
+
+
+metrics_registry.gauge_collector("db_pool_connections", "Database pool connections by state",
+                                 ("engine", "state"), _db_pool)
+metrics_registry.gauge_collector("s3_client", "Shared S3 client pool state", ("stat",), _s3_client)
+metrics_registry.gauge_collector("cat_cache", "In-process cat cache size and hit/miss counters",
+                                 ("stat",), _cat_cache)
+metrics_registry.gauge_collector("admission", "Admission budgets: limits, admitted and queued requests",
+                                 ("budget", "stat"), _admission)
@@ -0,0 +1,37 @@
+import time
+
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from src.metrics.registry import http_requests_total, http_request_duration
+
+
+class MetricsMiddleware:
+    """Замеряет время и статус ответа каждого HTTP-запроса с группировкой по шаблону маршрута"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Роутер кладет найденный маршрут в scope; по шаблону пути, а не по самому пути,
+            # чтобы число серий не зависело от id в URL
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            http_request_duration.observe(time.perf_counter() - started, method, path)
+            http_requests_total.inc(method, path, str(status_code))
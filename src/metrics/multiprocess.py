@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from src.metrics.registry import metrics_registry, MetricsRegistry
+from src.settings import settings
+
+
+class WorkerSnapshots:
+    """
+    Сведение метрик и статистики нескольких воркеров uvicorn. Каждый воркер раз в interval секунд
+    (и перед каждой выгрузкой) пишет снимок своих значений в общий каталог, а /api/metrics и /api/stats
+    читают снимки всех воркеров, поэтому ответ не зависит от того, какой воркер принял запрос.
+    Снимки завершившихся воркеров остаются: их счетчики входят в сумму, а gauge и статистика - нет.
+    """
+
+    def __init__(self, directory: str, interval: float, registry: MetricsRegistry):
+        self.directory = Path(directory) if directory else None
+        self.interval = interval
+        self.registry = registry
+        self.worker = str(os.getpid())
+        self._collect_stats: Callable[[], Dict[str, Any]] = dict
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    async def start(self, collect_stats: Callable[[], Dict[str, Any]]) -> None:
+        # Воркер мог быть создан через fork после импорта модуля; время старта - против повтора pid
+        self.worker = f"{os.getpid()}-{int(time.time())}"
+        self._collect_stats = collect_stats
+        if not self.enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.write()
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Worker {self.worker} writes metric snapshots to {self.directory}")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self.write()
+
+    def write(self) -> None:
+        snapshot = {"written_at": time.time(), "metrics": self.registry.dump(), "stats": self._collect_stats()}
+        path = self.directory / f"{self.worker}.json"
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(snapshot, default=str))
+        os.replace(temp_path, path)
+
+    def read(self) -> Dict[str, Dict[str, Any]]:
+        """Снимки всех воркеров, свежий снимок текущего пишется перед чтением"""
+        self.write()
+        snapshots = {}
+        for path in self.directory.glob("*.json"):
+            try:
+                snapshots[path.stem] = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping metric snapshot {path.name}: {e}")
+        return snapshots
+
+    def is_live(self, snapshot: Dict[str, Any]) -> bool:
+        return time.time() - snapshot["written_at"] < self.interval * 3
+
+    def render_metrics(self) -> str:
+        if not self.enabled:
+            return self.registry.render()
+        snapshots = self.read()
+        live = {worker for worker, snapshot in snapshots.items() if self.is_live(snapshot)}
+        return self.registry.render({worker: snapshot["metrics"] for worker, snapshot in snapshots.items()}, live)
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"worker": self.worker, **self._collect_stats()}
+        return {"worker": self.worker,
+                "workers": {worker: snapshot["stats"] for worker, snapshot in sorted(self.read().items())
+                            if self.is_live(snapshot)}}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                logging.error(f"Failed to write metric snapshot: {e}")
+
+
+def prepare_directory(directory: str) -> None:
+    """Вызывается в родительском процессе до старта воркеров: снимки прошлого запуска не суммируются"""
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    for stale in path.glob("*.json"):
+        stale.unlink()
+
+
+worker_snapshots = WorkerSnapshots(settings.metrics_dir, settings.metrics_snapshot_interval, metrics_registry)
@@ -0,0 +1,185 @@
+from bisect import bisect_left
+from typing import Any, Collection, Dict, List, Optional, Tuple, Sequence, Callable, Iterable
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def copy(self) -> "Counter":
+        return Counter(self.name, self.documentation, self.label_names)
+
+    def dump(self) -> List[Any]:
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, dumped: List[Any]) -> None:
+        for labels, value in dumped:
+            self.inc(*labels, amount=value)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждой серии: счетчики по корзинам (последняя - +Inf), сумма, количество
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+        series[1][1] += 1
+
+    def copy(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.label_names, self.buckets)
+
+    def dump(self) -> List[Any]:
+        return [[list(labels), counts, total, count] for labels, (counts, (total, count)) in self._series.items()]
+
+    def merge(self, dumped: List[Any]) -> None:
+        for labels, counts, total, count in dumped:
+            if len(counts) != len(self.buckets) + 1:
+                continue  # снимок с другими корзинами (до смены версии)
+            series = self._series.get(tuple(labels))
+            if series is None:
+                series = self._series[tuple(labels)] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            for idx, bucket_count in enumerate(counts):
+                series[0][idx] += bucket_count
+            series[1][0] += total
+            series[1][1] += count
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        bucket_names = self.label_names + ("le",)
+        for labels, (counts, (total, count)) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(bucket_names, (*labels, str(bound)))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.label_names, labels)} {count}"
+
+
+class GaugeCollector:
+    """Gauge, значения которого снимаются в момент выгрузки метрик"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.collect = collect
+
+    def dump(self) -> List[Any]:
+        return [[list(labels), value] for labels, value in self.collect()]
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self.collect():
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+
+
+class MetricsRegistry:
+    """
+    Метрики одного процесса. Все обновления идут из одного потока событийного цикла,
+    поэтому счетчики - обычные словари без блокировок. Несколько воркеров сводятся через снимки dump
+    (см. src.metrics.multiprocess).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def gauge_collector(self, name: str, documentation: str, label_names: Sequence[str],
+                        collect: Callable[[], Iterable[Tuple[LabelValues, float]]]) -> GaugeCollector:
+        return self._register(GaugeCollector(name, documentation, label_names, collect))
+
+    def dump(self) -> Dict[str, List[Any]]:
+        """Снимок значений всех метрик, пригодный для JSON"""
+        return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    def render(self, snapshots: Optional[Dict[str, Dict[str, List[Any]]]] = None,
+               live: Collection[str] = ()) -> str:
+        """
+        Без snapshots - метрики текущего процесса. Со snapshots (воркер -> dump) счетчики и гистограммы
+        суммируются по всем воркерам, включая завершившиеся, чтобы сумма не убывала, а gauge
+        отдаются по каждому живому воркеру с меткой worker.
+        """
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            if snapshots is None:
+                lines.extend(metric.render())
+            elif isinstance(metric, GaugeCollector):
+                values = [((worker, *labels), value) for worker, dumped in snapshots.items() if worker in live
+                          for labels, value in dumped.get(name, [])]
+                lines.extend(GaugeCollector(name, metric.documentation, ("worker", *metric.label_names),
+                                            lambda values=values: values).render())
+            else:
+                merged = metric.copy()
+                for dumped in snapshots.values():
+                    merged.merge(dumped.get(name, []))
+                lines.extend(merged.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+http_requests_total = metrics_registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = metrics_registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+db_statement_duration = metrics_registry.histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ("engine",))
+s3_operation_duration = metrics_registry.histogram(
+    "s3_operation_duration_seconds", "S3 API call latency", ("operation", "result"))
+broker_publish_duration = metrics_registry.histogram(
+    "broker_publish_duration_seconds", "RabbitMQ publish latency including confirm", ("result",))
+single_flight_calls_total = metrics_registry.counter(
+    "single_flight_calls_total", "Reads that ran a query vs joined an identical in-flight one", ("flight", "result"))
+admission_rejected_total = metrics_registry.counter(
+    "admission_rejected_total", "Requests shed with 503 by budget and reason", ("budget", "reason"))
@@ -0,0 +1,10 @@
+import asyncio
+import logging
+
+from src.database.migrations import run_migrations
+from src.settings import settings
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_migrations(settings.postgres_url))
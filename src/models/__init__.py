@@ -1,2 +1,5 @@
 from src.models.cats import CatModel
-from src.models.cats_images import CatImageModel
\ No newline at end of file
+from src.models.cats_images import CatImageModel
+from src.models.cats_images_variants import CatImageVariantModel
+from src.models.outbox import OutboxMessageModel
+from src.models.cats_images_objects import CatImageObjectModel
@@ -1,16 +1,23 @@
 from datetime import date
-from sqlalchemy.orm import Mapped, relationship
-from typing import List
-from src.database.data_types import intpk
+from sqlalchemy import Index
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from typing import Annotated, List
+from src.database.data_types import intpk, updated_at, version
 from src.database.base import Base
 
 
 class CatModel(Base):
     __tablename__ = "cats"
+    __table_args__ = (
+        Index("ix_cats_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     id: Mapped[intpk]
     name: Mapped[str]
-    birthday: Mapped[date]
-    color: Mapped[str]
-    images: Mapped[List["CatImageModel"]] = relationship(back_populates="cat", cascade="all, delete")
+    birthday: Mapped[Annotated[date, mapped_column(index=True)]]
+    color: Mapped[Annotated[str, mapped_column(index=True)]]
+    version: Mapped[version]
+    updated_at: Mapped[updated_at]
+    images: Mapped[List["CatImageModel"]] = relationship(back_populates="cat", cascade="all, delete",
+                                                         passive_deletes=True)
 
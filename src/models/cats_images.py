@@ -1,7 +1,7 @@
-from typing import Annotated, Optional
+from typing import Annotated, List
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from src.database.data_types import intpk
+from src.database.data_types import intpk, updated_at, version
 from src.database.base import Base
 
 
@@ -9,6 +9,11 @@ class CatImageModel(Base):
     __tablename__ = "cats_images"
 
     id: Mapped[intpk]
-    cat_id: Mapped[Annotated[int, mapped_column(ForeignKey("cats.id"))]]
-    image_url: Mapped[str]
+    cat_id: Mapped[Annotated[int, mapped_column(ForeignKey("cats.id", ondelete="CASCADE"), index=True)]]
+    image_url: Mapped[Annotated[str, mapped_column(index=True)]]
+    version: Mapped[version]
+    updated_at: Mapped[updated_at]
     cat: Mapped["CatModel"] = relationship(back_populates="images")
+    variants: Mapped[List["CatImageVariantModel"]] = relationship(back_populates="image", cascade="all, delete",
+                                                                   passive_deletes=True,
+                                                                   order_by="CatImageVariantModel.width")
@@ -0,0 +1,14 @@
+from typing import Annotated
+from sqlalchemy import CheckConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+from src.database.data_types import created_at
+from src.database.base import Base
+
+
+class CatImageObjectModel(Base):
+    __tablename__ = "cats_images_objects"
+    __table_args__ = (CheckConstraint("refcount >= 0"),)
+
+    image_url: Mapped[Annotated[str, mapped_column(primary_key=True)]]
+    refcount: Mapped[int]
+    created_at: Mapped[created_at]
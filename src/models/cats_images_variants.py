@@ -0,0 +1,16 @@
+from typing import Annotated
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from src.database.data_types import intpk
+from src.database.base import Base
+
+
+class CatImageVariantModel(Base):
+    __tablename__ = "cats_images_variants"
+    __table_args__ = (UniqueConstraint("image_id", "width"),)
+
+    id: Mapped[intpk]
+    image_id: Mapped[Annotated[int, mapped_column(ForeignKey("cats_images.id", ondelete="CASCADE"))]]
+    width: Mapped[int]
+    image_url: Mapped[str]
+    image: Mapped["CatImageModel"] = relationship(back_populates="variants")
@@ -0,0 +1,14 @@
+from typing import Annotated, Any, Dict, Optional
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+from src.database.data_types import intpk, created_at
+from src.database.base import Base
+
+
+class OutboxMessageModel(Base):
+    __tablename__ = "outbox"
+
+    id: Mapped[intpk]
+    routing_key: Mapped[Optional[str]]
+    payload: Mapped[Annotated[Dict[str, Any], mapped_column(JSONB)]]
+    created_at: Mapped[created_at]
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from typing import Optional, Iterable, List, Dict, Union, Tuple
+
+from sqlalchemy import select, delete
+
+from src.database.db_session import AsyncPostgresClient
+from src.images.thumbnails import variant_object_name
+from src.models import CatImageObjectModel
+from src.s3.s3_service import S3Service
+from src.settings import settings
+
+# Освобожденный объект: url оригинала и известные ссылки на его уменьшенные копии
+Released = Tuple[str, Tuple[str, ...]]
+
+
+class S3ObjectReaper:
+    """
+    Фоновое удаление объектов S3 пачками через delete_objects.
+    Ключи из enqueue удаляются безусловно. Объекты из enqueue_released удаляются, только если
+    под блокировкой их строки в cats_images_objects счетчик ссылок все еще нулевой,
+    и вместе с удалением объекта удаляется сама строка.
+    """
+
+    def __init__(self, batch_size: int = 1000, flush_interval: float = 1.0, retry_after: float = 30.0):
+        self.batch_size = min(batch_size, 1000)  # ограничение DeleteObjects
+        self.flush_interval = flush_interval
+        self.retry_after = retry_after
+        self._queue: asyncio.Queue[Optional[Union[str, Released]]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, object_names: Iterable[str]) -> None:
+        for name in object_names:
+            self._queue.put_nowait(name)
+
+    def enqueue_released(self, released: Dict[str, Iterable[str]]) -> None:
+        """Вызывается после коммита транзакции, обнулившей счетчики: image_url -> url его копий"""
+        for image_url, variant_urls in released.items():
+            self._queue.put_nowait((image_url, tuple(variant_urls)))
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        # Объекты, освобожденные до перезапуска процесса или не удаленные из-за ошибки S3
+        query = select(CatImageObjectModel.image_url).filter(CatImageObjectModel.refcount == 0)
+        async with AsyncPostgresClient.get_async_session()() as session:
+            self.enqueue_released({image_url: () for image_url in await session.scalars(query)})
+        logging.info("S3 reaper started")
+
+    async def stop(self) -> None:
+        """Дожидается удаления всего, что уже попало в очередь"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        logging.info("S3 reaper stopped")
+
+    async def _delete(self, batch: List[Union[str, Released]]) -> None:
+        names = [item for item in batch if isinstance(item, str)]
+        released: Dict[str, Tuple[str, ...]] = {}
+        for item in batch:
+            if not isinstance(item, str):
+                released[item[0]] = (*released.get(item[0], ()), *item[1])
+        if released:
+            await self._delete_released(released)
+        if not names:
+            return
+        try:
+            failed = await S3Service.delete_file_objects(names)
+        except Exception as e:
+            logging.error(f"Failed to delete {len(names)} S3 objects: {e}")
+            return
+        if failed:
+            logging.warning(f"S3 refused to delete {len(failed)} objects: {failed[:10]}")
+
+    async def _delete_released(self, released: Dict[str, Tuple[str, ...]]) -> None:
+        # Загрузка того же содержимого ждет блокировку строки и после нее загружает объект заново
+        query = (
+            select(CatImageObjectModel.image_url)
+            .filter(CatImageObjectModel.image_url.in_(released), CatImageObjectModel.refcount == 0)
+            .order_by(CatImageObjectModel.image_url)
+            .with_for_update()
+        )
+        try:
+            async with AsyncPostgresClient.get_async_session()() as session:
+                unused = list(await session.scalars(query))
+                if not unused:
+                    return
+                names = {}
+                for image_url in unused:
+                    object_name = S3Service.object_name_from_url(image_url)
+                    variants = {variant_object_name(object_name, width) for width in settings.thumbnail_sizes}
+                    variants.update(S3Service.object_name_from_url(url) for url in released[image_url])
+                    for name in (object_name, *variants):
+                        names[name] = image_url
+                keys = list(names)
+                failed = []
+                for offset in range(0, len(keys), 1000):
+                    failed += await S3Service.delete_file_objects(keys[offset:offset + 1000])
+                kept = {names[name] for name in failed}
+                deleted = [image_url for image_url in unused if image_url not in kept]
+                if deleted:
+                    await session.execute(delete(CatImageObjectModel)
+                                          .filter(CatImageObjectModel.image_url.in_(deleted)))
+                await session.commit()
+        except Exception as e:
+            logging.error(f"Failed to delete {len(released)} released S3 objects: {e}")
+            failed_urls = set(released)
+        else:
+            failed_urls = set(unused) - set(deleted)
+        if failed_urls:
+            # Строки остаются с нулевым счетчиком, объекты удалятся следующей попыткой
+            asyncio.get_running_loop().call_later(
+                self.retry_after, self.enqueue_released, {url: released[url] for url in failed_urls})
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            name = await self._queue.get()
+            if name is None:
+                break
+            batch = [name]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        name = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    name = self._queue.get_nowait()
+                if name is None:
+                    stopping = True
+                    break
+                batch.append(name)
+            await self._delete(batch)
+
+
+s3_reaper = S3ObjectReaper(batch_size=settings.s3_reaper_batch_size,
+                           flush_interval=settings.s3_reaper_flush_interval)
@@ -1,11 +1,17 @@
+import asyncio
 import logging
-from contextlib import asynccontextmanager
-from typing import Optional
+import time
+import weakref
+from contextlib import asynccontextmanager, AsyncExitStack
+from datetime import datetime
+from typing import Optional, Dict, Any, List, AsyncIterator
 
 from botocore.exceptions import ClientError
 from types_aiobotocore_s3.client import S3Client
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session, AioSession
 
+from src.metrics.registry import s3_operation_duration
 from src.settings import settings
 
 
@@ -14,6 +20,11 @@ class S3Service:
     config: Optional[dict] = None
     bucket_name: Optional[str] = None
     session: Optional[AioSession] = None
+    client: Optional[S3Client] = None
+    max_pool_connections: int = 0
+    _exit_stack: Optional[AsyncExitStack] = None
+    _pool: Optional[asyncio.Semaphore] = None
+    _stats: Dict[str, float] = {}
 
     @classmethod
     async def init_s3(
@@ -23,7 +34,13 @@ class S3Service:
             external_url: str,
             access_key: str,
             secret_key: str,
+            max_pool_connections: int = 10,
+            connect_timeout: float = 5.0,
+            read_timeout: float = 60.0,
+            keepalive_timeout: float = 60.0,
+            client: Optional[S3Client] = None,
     ) -> None:
+        """client - готовый клиент (например, заглушка в бенчмарках); его жизненным циклом управляет вызывающий"""
 
         if cls.session is not None:
             print("S3 is already initialized")
@@ -32,10 +49,28 @@ class S3Service:
         cls.config = {
             "aws_access_key_id": access_key,
             "aws_secret_access_key": secret_key,
-            "endpoint_url": endpoint_url
+            "endpoint_url": endpoint_url,
+            "config": AioConfig(
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                tcp_keepalive=True,
+                connector_args={"keepalive_timeout": keepalive_timeout},
+                retries={"max_attempts": 3, "mode": "standard"},
+            )
         }
         cls.bucket_name = bucket_name
         cls.session = get_session()
+        cls._exit_stack = AsyncExitStack()
+        if client is None:
+            client = await cls._exit_stack.enter_async_context(cls.session.create_client("s3", **cls.config))
+        cls.client = client
+        cls.client.meta.events.register("before-call.s3", cls._on_before_call)
+        cls.client.meta.events.register("after-call.s3", cls._on_after_call)
+        cls.client.meta.events.register("after-call-error.s3", cls._on_after_call_error)
+        cls.max_pool_connections = max_pool_connections
+        cls._pool = asyncio.Semaphore(max_pool_connections)
+        cls._stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "pool_waits": 0, "pool_wait_seconds": 0.0}
         logging.info("S3 initialized")
 
     @classmethod
@@ -43,22 +78,264 @@ class S3Service:
         if cls.session is None:
             logging.warning("S3 is already closed")
             return
+        await cls._exit_stack.aclose()
+        cls._exit_stack = None
+        cls.client = None
+        cls._pool = None
         cls.bucket_name = None
         cls.config = None
         cls.session = None
 
+    @staticmethod
+    def _on_before_call(model, context: Dict[str, Any], **_kwargs) -> None:
+        # after-call-error получает только context и exception, поэтому имя операции сохраняется здесь
+        context["metrics_operation"] = model.name
+        context["metrics_started"] = time.perf_counter()
+
+    @staticmethod
+    def _on_after_call(http_response, context: Dict[str, Any], **_kwargs) -> None:
+        result = "success" if http_response.status_code < 400 else str(http_response.status_code)
+        s3_operation_duration.observe(time.perf_counter() - context["metrics_started"],
+                                      context["metrics_operation"], result)
+
+    @staticmethod
+    def _on_after_call_error(context: Dict[str, Any], **_kwargs) -> None:
+        if "metrics_started" not in context:
+            return
+        s3_operation_duration.observe(time.perf_counter() - context["metrics_started"],
+                                      context["metrics_operation"], "error")
+
+    @classmethod
+    async def _acquire_slot(cls) -> None:
+        waited = cls._pool.locked()
+        started = time.perf_counter()
+        await cls._pool.acquire()
+        if waited:
+            cls._stats["pool_waits"] += 1
+            cls._stats["pool_wait_seconds"] += time.perf_counter() - started
+        cls._stats["requests"] += 1
+        cls._stats["in_flight"] += 1
+        cls._stats["peak_in_flight"] = max(cls._stats["peak_in_flight"], cls._stats["in_flight"])
+
+    @classmethod
+    def _release_slot(cls) -> None:
+        cls._stats["in_flight"] -= 1
+        cls._pool.release()
+
     @classmethod
     @asynccontextmanager
     async def get_client(cls):
-        async with cls.session.create_client("s3", **cls.config) as client:
-            yield client
+        """Выдает общий клиент, ограничивая число одновременных запросов размером пула соединений"""
+        await cls._acquire_slot()
+        try:
+            yield cls.client
+        finally:
+            cls._release_slot()
+
+    @classmethod
+    def is_saturated(cls) -> bool:
+        """Все слоты пула соединений заняты"""
+        return cls._pool is not None and cls._pool.locked()
 
     @classmethod
-    async def upload_file_object(cls, object_name, content) -> str:
+    def get_stats(cls) -> Dict[str, Any]:
+        return {"max_pool_connections": cls.max_pool_connections, **cls._stats}
+
+    @classmethod
+    async def upload_file_object(cls, object_name, content, content_type: Optional[str] = None,
+                                 cache_control: Optional[str] = None) -> str:
+        params = {"ContentType": content_type} if content_type is not None else {}
+        if cache_control is not None:
+            params["CacheControl"] = cache_control
         async with cls.get_client() as client:
             client: S3Client
-            await client.put_object(Bucket=cls.bucket_name, Key=object_name, Body=content)
-            return f"{cls.external_url}/{cls.bucket_name}/{object_name}"
+            await client.put_object(Bucket=cls.bucket_name, Key=object_name, Body=content, **params)
+            return cls.object_url(object_name)
+
+    @classmethod
+    async def upload_stream(cls, object_name: str, stream, content_type: str,
+                            part_size: int = 8 * 1024 * 1024, concurrency: int = 4,
+                            cache_control: Optional[str] = None) -> str:
+        """
+        Загрузка из потока с асинхронным read(n) частями по part_size байт.
+        Маленькие файлы уходят одним put_object, большие - multipart-загрузкой,
+        в памяти одновременно находится не больше concurrency частей.
+        """
+        headers = {"ContentType": content_type}
+        if cache_control is not None:
+            headers["CacheControl"] = cache_control
+        first = await stream.read(part_size)
+        if len(first) < part_size:
+            async with cls.get_client() as client:
+                client: S3Client
+                await client.put_object(Bucket=cls.bucket_name, Key=object_name, Body=first,
+                                        ContentLength=len(first), **headers)
+            return cls.object_url(object_name)
+
+        async with cls.get_client() as client:
+            client: S3Client
+            upload = await client.create_multipart_upload(Bucket=cls.bucket_name, Key=object_name, **headers)
+        upload_id = upload["UploadId"]
+        slots = asyncio.Semaphore(concurrency)
+        failures: List[BaseException] = []
+
+        async def upload_part(number: int, body: bytes) -> Dict[str, Any]:
+            try:
+                async with cls.get_client() as part_client:
+                    part_client: S3Client
+                    resp = await part_client.upload_part(Bucket=cls.bucket_name, Key=object_name,
+                                                         UploadId=upload_id, PartNumber=number,
+                                                         Body=body, ContentLength=len(body))
+                return {"PartNumber": number, "ETag": resp["ETag"]}
+            except BaseException as e:
+                failures.append(e)
+                raise
+            finally:
+                slots.release()
+
+        tasks: List[asyncio.Task] = []
+        try:
+            chunk = first
+            while True:
+                await slots.acquire()
+                if failures:
+                    raise failures[0]
+                if chunk is None:
+                    chunk = await stream.read(part_size)
+                if not chunk:
+                    slots.release()
+                    break
+                tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, chunk)))
+                chunk = None
+            parts = await asyncio.gather(*tasks)
+            async with cls.get_client() as client:
+                await client.complete_multipart_upload(Bucket=cls.bucket_name, Key=object_name, UploadId=upload_id,
+                                                       MultipartUpload={"Parts": parts})
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            async with cls.get_client() as client:
+                await client.abort_multipart_upload(Bucket=cls.bucket_name, Key=object_name, UploadId=upload_id)
+            logging.warning(f"Multipart upload of {object_name} aborted")
+            raise
+        return cls.object_url(object_name)
+
+    @classmethod
+    def object_url(cls, object_name: str) -> str:
+        return f"{cls.external_url}/{cls.bucket_name}/{object_name}"
+
+    @classmethod
+    async def copy_file_object(cls, source_name: str, object_name: str, content_type: str,
+                               cache_control: Optional[str] = None) -> str:
+        """Копирование внутри бакета без передачи данных через приложение, с заменой метаданных"""
+        params = {"ContentType": content_type}
+        if cache_control is not None:
+            params["CacheControl"] = cache_control
+        async with cls.get_client() as client:
+            client: S3Client
+            await client.copy_object(Bucket=cls.bucket_name, Key=object_name,
+                                     CopySource={"Bucket": cls.bucket_name, "Key": source_name},
+                                     MetadataDirective="REPLACE", **params)
+        return cls.object_url(object_name)
+
+    @classmethod
+    def object_name_from_url(cls, url: str) -> str:
+        return url.split(f"/{cls.bucket_name}/", 1)[-1]
+
+    @classmethod
+    async def generate_upload_post(cls, object_name: str, content_type: str, max_size: int,
+                                   expires_in: int = 900, cache_control: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Подписанная форма POST для загрузки одного объекта клиентом напрямую в S3.
+        Политика фиксирует ключ, Content-Type и допустимый размер. Подпись считается локально,
+        поэтому пул соединений не занимается, а адрес внутреннего endpoint заменяется на внешний
+        """
+        fields = {"Content-Type": content_type}
+        if cache_control is not None:
+            fields["Cache-Control"] = cache_control
+        presigned = await cls.client.generate_presigned_post(
+            Bucket=cls.bucket_name,
+            Key=object_name,
+            Fields=fields,
+            Conditions=[*({name: value} for name, value in fields.items()), ["content-length-range", 1, max_size]],
+            ExpiresIn=expires_in,
+        )
+        return {"url": presigned["url"].replace(cls.config["endpoint_url"], cls.external_url, 1),
+                "fields": presigned["fields"]}
+
+    @classmethod
+    async def head_file_object(cls, object_name: str) -> Optional[Dict[str, Any]]:
+        """Метаданные объекта (ContentLength, ContentType, ETag), None если объекта нет"""
+        async with cls.get_client() as client:
+            client: S3Client
+            try:
+                return await client.head_object(Bucket=cls.bucket_name, Key=object_name)
+            except ClientError as e:
+                if e.response["Error"]["Code"] in ("NoSuchKey", "NotFound", "404"):
+                    return None
+                raise
+
+    @classmethod
+    async def open_file_stream(
+            cls,
+            object_name: str,
+            range_header: Optional[str] = None,
+            if_none_match: Optional[str] = None,
+            if_modified_since: Optional[datetime] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Ответ get_object с непрочитанным телом, None если объекта нет.
+        Ответы 304/412/416 пробрасываются как ClientError.
+        Открытое тело держит соединение пула, поэтому слот занят, пока поток не закроет iter_body.
+        """
+        params: Dict[str, Any] = {"Bucket": cls.bucket_name, "Key": object_name}
+        if range_header is not None:
+            params["Range"] = range_header
+        if if_none_match is not None:
+            params["IfNoneMatch"] = if_none_match
+        if if_modified_since is not None:
+            params["IfModifiedSince"] = if_modified_since
+        await cls._acquire_slot()
+        try:
+            return await cls.client.get_object(**params)
+        except ClientError as e:
+            cls._release_slot()
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                logging.info("No object found")
+                return None
+            raise
+        except BaseException:
+            cls._release_slot()
+            raise
+
+    @classmethod
+    def iter_body(cls, body, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """
+        Чтение тела из open_file_stream. Тело закрывается и слот пула освобождается ровно один раз:
+        по окончании чтения, при ошибке или отмене, а если ответ так и не начал отправляться -
+        когда итератор собирает сборщик мусора.
+        """
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if released:
+                return
+            released = True
+            body.close()
+            cls._release_slot()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in body.iter_chunks(chunk_size):
+                    yield chunk
+            finally:
+                release()
+
+        iterator = chunks()
+        weakref.finalize(iterator, release)
+        return iterator
 
     @classmethod
     async def get_file_object(cls, object_name) -> Optional[bytes]:
@@ -84,4 +361,15 @@ class S3Service:
             client: S3Client
             await client.delete_object(Bucket=cls.bucket_name, Key=object_name)
 
+    @classmethod
+    async def delete_file_objects(cls, object_names: List[str]) -> List[str]:
+        """Удаление до 1000 объектов одним запросом; возвращает ключи, которые удалить не удалось"""
+        async with cls.get_client() as client:
+            client: S3Client
+            resp = await client.delete_objects(Bucket=cls.bucket_name, Delete={
+                "Objects": [{"Key": name} for name in object_names],
+                "Quiet": True,
+            })
+        return [error["Key"] for error in resp.get("Errors", [])]
+
 
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict, Field
 from datetime import date
-from typing import Annotated, List, Optional
+from typing import Annotated, Dict, List, Optional
 from src.schemes.cats_images import CatImageScheme
 
 
@@ -29,3 +29,20 @@ class CatFullAddScheme(CatAddScheme):
 class CatFullScheme(CatFullAddScheme, CatScheme):
     pass
 
+
+class CatPageScheme(BaseModel):
+    items: List[CatScheme]
+    next_cursor: Optional[str] = None
+
+
+class CatIdsScheme(BaseModel):
+    ids: List[int]
+
+
+class CatSearchHitScheme(CatScheme):
+    rank: float
+
+
+class CatSearchScheme(BaseModel):
+    items: List[CatSearchHitScheme]
+    facets: Dict[str, int]
@@ -1,3 +1,5 @@
+from typing import Dict, Literal
+
 from pydantic import BaseModel, ConfigDict
 
 
@@ -12,3 +14,18 @@ class CatImageScheme(BaseModel):
 class CatImageURLScheme(BaseModel):
     image_url: str
 
+
+
+class CatImageUploadScheme(BaseModel):
+    content_type: Literal["image/png", "image/jpeg", "image/svg+xml", "image/gif"]
+
+
+class CatImageUploadURLScheme(BaseModel):
+    url: str
+    fields: Dict[str, str]
+    object_name: str
+    expires_in: int
+
+
+class CatImageUploadCompleteScheme(BaseModel):
+    object_name: str
@@ -1,3 +1,6 @@
+import os
+from typing import List
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,24 +10,82 @@ class Settings(BaseSettings):
 
     host: str
     port: int
+    debug: bool = False
+    server_workers: int = 0  # 0 - по процессу на ядро
+    server_loop: str = "auto"  # auto выбирает uvloop и httptools, если они установлены
+    server_http: str = "auto"
+    server_backlog: int = 2048
+    server_keep_alive: int = 5
+    server_graceful_timeout: int = 30
+    # Каталог снимков метрик воркеров; при нескольких воркерах main.py создает временный, если не задан
+    metrics_dir: str = ""
+    metrics_snapshot_interval: float = 5.0
+    admission_read_limit: int = 64
+    admission_read_queue: int = 256
+    admission_write_limit: int = 32
+    admission_write_queue: int = 64
+    admission_upload_limit: int = 8
+    admission_upload_queue: int = 16
+    admission_queue_timeout: float = 1.0
+    admission_retry_after: int = 1
 
     postgres_user: str
     postgres_password: str
     postgres_host: str
     postgres_port: int
     postgres_database: str
+    postgres_pool_size: int = 10
+    postgres_max_overflow: int = 10
+    # Бюджет соединений к каждой базе на все воркеры сервера (0 - без ограничения): пул воркера
+    # уменьшается до своей доли, чтобы число процессов не умножало число соединений сверх max_connections.
+    # Воркер миниатюр - один процесс, его пул считается от бюджета целиком
+    postgres_max_connections: int = 80
+    postgres_pool_timeout: float = 30.0
+    postgres_pool_recycle: int = 1800
+    postgres_pool_pre_ping: bool = True
+    postgres_statement_cache_size: int = 100
+    postgres_echo: bool = False
+    postgres_replica_hosts: List[str] = []
+    postgres_replica_retry_after: float = 10.0
+    read_your_writes_seconds: float = 5.0
+    postgres_migrate_on_start: bool = True
 
     s3_url: str
     s3_access_key: str
     s3_secret_key: str
     s3_bucket: str
     s3_external_url: str
+    s3_max_pool_connections: int = 50
+    s3_connect_timeout: float = 5.0
+    s3_read_timeout: float = 60.0
+    s3_keepalive_timeout: float = 60.0
+    s3_part_size: int = 8 * 1024 * 1024
+    s3_upload_concurrency: int = 4
+    s3_reaper_batch_size: int = 1000
+    s3_reaper_flush_interval: float = 1.0
+    s3_upload_url_ttl: int = 900
+    image_max_size: int = 20 * 1024 * 1024
 
     broker_host: str
     broker_port: int
     broker_user: str
     broker_password: str
     broker_queue: str
+    outbox_batch_size: int = 100
+    outbox_poll_interval: float = 1.0
+
+    worker_prefetch_count: int = 50
+    worker_concurrency: int = 10
+    worker_stats_interval: float = 60.0
+    worker_max_attempts: int = 5
+    worker_retry_delay: float = 1.0  # перед повтором, растет линейно с номером попытки
+
+    cat_cache_size: int = 10_000
+    cat_cache_ttl: float = 30.0
+    cat_cache_exchange: str = "cats_cache_invalidation"
+
+    thumbnail_sizes: List[int] = [128, 512]
+    thumbnail_processes: int = 2
 
     @property
     def postgres_url(self) -> str:
@@ -35,6 +96,54 @@ class Settings(BaseSettings):
             f"/{self.postgres_database}"
         )
 
+    @property
+    def postgres_replica_urls(self) -> List[str]:
+        return [
+            f"postgresql+asyncpg:"
+            f"//{self.postgres_user}:{self.postgres_password}"
+            f"@{host}"
+            f"/{self.postgres_database}"
+            for host in self.postgres_replica_hosts
+        ]
+
+    @property
+    def server_worker_count(self) -> int:
+        return self.server_workers or os.cpu_count() or 1
+
+    def postgres_pool_limits_for(self, processes: int) -> tuple:
+        """(pool_size, max_overflow) одного из processes процессов в пределах его доли postgres_max_connections"""
+        pool_size, max_overflow = self.postgres_pool_size, self.postgres_max_overflow
+        if not self.postgres_max_connections:
+            return pool_size, max_overflow
+        share = max(self.postgres_max_connections // processes, 1)
+        if share >= pool_size + max_overflow:
+            return pool_size, max_overflow
+        # Постоянная часть и overflow уменьшаются пропорционально
+        reduced_pool_size = max(share * pool_size // (pool_size + max_overflow), 1)
+        return reduced_pool_size, share - reduced_pool_size
+
+    @property
+    def postgres_pool_limits(self) -> tuple:
+        """Пул одного воркера сервера"""
+        return self.postgres_pool_limits_for(self.server_worker_count)
+
+    def postgres_engine_options_for(self, processes: int) -> dict:
+        pool_size, max_overflow = self.postgres_pool_limits_for(processes)
+        return {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": self.postgres_pool_timeout,
+            "pool_recycle": self.postgres_pool_recycle,
+            "pool_pre_ping": self.postgres_pool_pre_ping,
+            "statement_cache_size": self.postgres_statement_cache_size,
+            "echo": self.postgres_echo,
+        }
+
+    @property
+    def postgres_engine_options(self) -> dict:
+        """Параметры движка для воркера сервера; отдельные процессы (воркер миниатюр) берут свои через _for(1)"""
+        return self.postgres_engine_options_for(self.server_worker_count)
+
     @property
     def broker_url(self) -> str:
         return (
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import signal
+from concurrent.futures import ProcessPoolExecutor
+
+from src.cache.cat_cache import cat_cache
+from src.database.db_session import AsyncPostgresClient
+from src.images.thumbnail_handler import ThumbnailHandler
+from src.message_broker.broker_service import RabbitMQService
+from src.message_broker.consumer_worker import ConsumerWorker
+from src.s3.s3_service import S3Service
+from src.settings import settings
+
+
+async def main() -> None:
+    broker = RabbitMQService(url=settings.broker_url, queue_name=settings.broker_queue,
+                             prefetch_count=settings.worker_prefetch_count)
+    # Один процесс: пул не делится на число воркеров сервера
+    await AsyncPostgresClient.init_postgres(settings.postgres_url, **settings.postgres_engine_options_for(1))
+    await S3Service.init_s3(bucket_name=settings.s3_bucket, endpoint_url=settings.s3_url,
+                            access_key=settings.s3_access_key, secret_key=settings.s3_secret_key,
+                            external_url=settings.s3_external_url,
+                            max_pool_connections=settings.s3_max_pool_connections,
+                            connect_timeout=settings.s3_connect_timeout,
+                            read_timeout=settings.s3_read_timeout,
+                            keepalive_timeout=settings.s3_keepalive_timeout)
+    await broker.connect()
+    await cat_cache.start(listen=False)
+    logging.info("Worker resources have been successfully initialized")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    with ProcessPoolExecutor(max_workers=settings.thumbnail_processes) as executor:
+        worker = ConsumerWorker(broker, handler=ThumbnailHandler(executor),
+                                concurrency=settings.worker_concurrency,
+                                stats_interval=settings.worker_stats_interval,
+                                max_attempts=settings.worker_max_attempts,
+                                retry_delay=settings.worker_retry_delay)
+        await worker.start()
+        await stop.wait()
+        logging.info("Shutting down, draining in-flight messages")
+        await worker.drain()
+
+    await broker.disconnect()
+    await cat_cache.stop()
+    await S3Service.close_s3()
+    await AsyncPostgresClient.close_postgres()
+    logging.info("Worker resources have been successfully closed")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())